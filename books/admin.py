@@ -1,37 +1,154 @@
 from django.contrib import admin
-from .models import Author, Book, Publisher
+from django.db.models import Prefetch
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
+from django.utils.html import format_html
+
+from . import jobs
+from .deletion import start_publisher_deletion
+from .forms import AuthorForm
+from .models import Author, Book, Classification, DeletionTask, Job, Publisher
+from .pagination import EstimatedCountPaginator
 
 
 class AuthorAdmin(admin.ModelAdmin):
+    form = AuthorForm
     fields = ["email", "first_name", "last_name"]
     search_fields = ["first_name", "last_name"]
+    # No COUNT(*) over the whole table on every changelist page
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ["remove_in_background"]
+
+    @admin.action(description="Remove selected authors in the background", permissions=["delete"])
+    def remove_in_background(self, request, queryset):
+        author_ids = list(queryset.values_list("id", flat=True))
+        job = jobs.enqueue("remove_author", {"author_ids": author_ids}, user=request.user)
+        self.message_user(request, f"Queued job #{job.id} to remove {len(author_ids)} authors")
 
 
 class BookAdmin(admin.ModelAdmin):
     fieldsets = [
-        (None, {"fields": ["title", "authors", "publisher"]}),
+        (None, {"fields": ["title", "authors", "publisher", "classification"]}),
         ("Date information", {
             "fields": ["publication_date"],
             "classes": ["collapse"],
         }),
     ]
-    list_display = ["title", "publisher", "was_published_recently"]
+    list_display = ["title", "author", "publisher", "was_published_recently"]
     list_filter = ["publication_date"]
+    list_select_related = ["publisher"]
     search_fields = ["title"]
-    filter_horizontal = ["authors"]
+    # Search as you type instead of rendering every author and publisher
+    autocomplete_fields = ["authors", "publisher", "classification"]
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def get_queryset(self, request):
+        # Book.author() reads self.authors.all(), one prefetch serves the whole page
+        authors = Author.objects.only("id", "first_name", "last_name")
+        return super().get_queryset(request).prefetch_related(Prefetch("authors", queryset=authors))
+
+    def lookup_allowed(self, lookup, value):
+        # Used by the "all books" link of the publisher page
+        return lookup == "publisher__id__exact" or super().lookup_allowed(lookup, value)
+
+
+class LimitedInlineFormSet(BaseInlineFormSet):
+    """Shows only the first `max_rows` related objects."""
+    max_rows = 20
 
+    def get_queryset(self):
+        # The formset asks for its queryset once per form, evaluate the slice only once
+        if not hasattr(self, "_limited"):
+            self._limited = list(super().get_queryset()[:self.max_rows])
+        return self._limited
 
-class BookInline(admin.StackedInline):
+
+class BookInline(admin.TabularInline):
     model = Book
-    extra = 3
+    formset = LimitedInlineFormSet
+    fields = ["title", "publication_date"]
+    readonly_fields = ["title", "publication_date"]
+    ordering = ["-publication_date", "-id"]
+    extra = 0
+    can_delete = False
+    show_change_link = True
+    verbose_name_plural = f"Latest books (up to {LimitedInlineFormSet.max_rows})"
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class ClassificationAdmin(admin.ModelAdmin):
+    search_fields = ["code", "name"]
+    list_display = ["code", "name"]
 
 
 class PublisherAdmin(admin.ModelAdmin):
     inlines = [BookInline]
     search_fields = ["name", "city", "country", "website"]
     list_display = ["name", "city", "country", "website"]
+    readonly_fields = ["all_books"]
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    @admin.display(description="Books")
+    def all_books(self, obj):
+        if obj.pk is None:
+            return "-"
+        url = reverse("admin:books_book_changelist") + f"?publisher__id__exact={obj.pk}"
+        return format_html('<a href="{}">View all books of this publisher</a>', url)
+
+    # Hand the cascade to the chunked deleter instead of the delete collector
+    def delete_model(self, request, obj):
+        start_publisher_deletion(obj)
+
+    def delete_queryset(self, request, queryset):
+        for publisher in queryset:
+            start_publisher_deletion(publisher)
+
+    def get_deleted_objects(self, objs, request):
+        # The confirmation page would list every book of the publisher,
+        # only show the publishers themselves.
+        objs = list(objs)
+        perms_needed = set()
+        if not self.has_delete_permission(request):
+            perms_needed.add(self.opts.verbose_name)
+        model_count = {self.opts.verbose_name_plural: len(objs)}
+        return [str(obj) for obj in objs], model_count, perms_needed, []
+
+
+class DeletionTaskAdmin(admin.ModelAdmin):
+    list_display = ["publisher_name", "status", "deleted_books", "total_books", "created_at", "finished_at"]
+    list_filter = ["status"]
+    readonly_fields = [f.name for f in DeletionTask._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ["id", "kind", "status", "progress", "total", "message", "created_by", "created_at"]
+    list_filter = ["status", "kind"]
+    list_select_related = ["created_by"]
+    readonly_fields = [f.name for f in Job._meta.fields]
+    actions = ["requeue"]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Run selected failed jobs again")
+    def requeue(self, request, queryset):
+        count = queryset.filter(status=Job.FAILED).update(
+            status=Job.QUEUED, error="", worker="", started_at=None, finished_at=None
+        )
+        self.message_user(request, f"Queued {count} jobs again")
 
 
 admin.site.register(Author, AuthorAdmin)
 admin.site.register(Book, BookAdmin)
+admin.site.register(Classification, ClassificationAdmin)
+admin.site.register(DeletionTask, DeletionTaskAdmin)
+admin.site.register(Job, JobAdmin)
 admin.site.register(Publisher, PublisherAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BooksConfig(AppConfig):
     name = 'books'
+
+    def ready(self):
+        # Connect the signal receivers
+        from books import signals  # noqa: F401
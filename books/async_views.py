@@ -0,0 +1,127 @@
+"""
+Async versions of the read-only catalog pages, served instead of the ones
+in books/views.py when BOOKS_ASYNC_VIEWS is on (mysite/asgi.py turns it on
+for the ASGI entry point).
+
+Same pages, same templates, but the queries go through the async ORM
+(aget, async for), so a request waiting on the database or on a slow client
+doesn't hold a thread. Everything a template shows is loaded before it is
+rendered, so rendering runs no queries. It still runs in sync_to_async
+(arender) and not on the event loop: {% catalogcache %} reads and writes
+the file cache, and waits for another request rebuilding the same
+fragment. The few other things with no async API (the lazy request.user,
+the FTS5 search, prefetch_related_objects) run in sync_to_async too.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404
+from django.shortcuts import render
+
+from . import objectcache, reference
+from .conditional import conditional_page
+from .forms import AuthorSearchForm, PublisherSearchForm
+from .models import Author, Book, Classification
+from .pagination import InvalidCursor
+from .views import (
+    all_books_state, author_books, author_names, author_search, author_state, book_state,
+    classification_state, classifications_state, paginate_books, publisher_search,
+)
+
+
+# Template rendering blocks, see above
+arender = sync_to_async(render)
+
+
+def login_required(view):
+    """django.contrib.auth's login_required for async views."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Loading the user from the session is a query
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def load_page(request, queryset):
+    try:
+        return await paginate_books(request, queryset).aload()
+    except InvalidCursor:
+        raise Http404("Invalid page cursor")
+
+
+@login_required
+@conditional_page(all_books_state)
+async def book_list(request):
+    books = await load_page(request, Book.objects.all())
+    return await arender(request, 'books/book_list.html', {'books': books, 'page': books})
+
+
+@login_required
+@conditional_page(book_state)
+async def book_detail(request, book_id):
+    book = await objectcache.aget_object_or_404(Book, book_id)
+    await sync_to_async(prefetch_related_objects)([book], Prefetch("authors", queryset=author_names()))
+    return await arender(request, 'books/book_detail.html', {'book': book})
+
+
+@login_required
+@conditional_page(author_state)
+async def author_detail(request, author_id):
+    author = await objectcache.aget_object_or_404(Author, author_id)
+    books = [book async for book in author_books(author)]
+    return await arender(request, 'books/author_detail.html', {'author': author, 'books': books})
+
+
+@login_required
+@conditional_page(classifications_state)
+async def classification_list(request):
+    await sync_to_async(reference.snapshot)()  # Checks the version row, lookups below need no query
+    return await arender(request, 'books/classification_list.html', {'classifications': reference.classifications()})
+
+
+@login_required
+@conditional_page(classification_state)
+async def classification_detail(request, classification_id):
+    await sync_to_async(reference.snapshot)()
+    try:
+        classification = reference.classification(classification_id)
+    except Classification.DoesNotExist:
+        raise Http404("No Classification matches the given query.")
+    books = await load_page(request, Book.objects.filter(classification_id=classification.id))
+    return await arender(request, 'books/classification_detail.html', {
+        'classification': classification,
+        'books': books,
+        'page': books,
+    })
+
+
+async def search_results(search, request):
+    # The FTS5 search is raw SQL, the fallback is a queryset
+    results, page = await sync_to_async(search)(request)
+    if page is None:
+        results = [obj async for obj in results]
+    return results, page
+
+
+@login_required
+async def author_list(request):
+    authors, page = await search_results(author_search, request)
+    return await arender(request, 'books/author_list.html', {
+        'authors': authors,
+        'form': AuthorSearchForm(request.GET),
+        'search_page': page,
+    })
+
+
+@login_required
+async def publisher_list(request):
+    publishers, page = await search_results(publisher_search, request)
+    return await arender(request, 'books/publisher_list.html', {
+        'publishers': publishers,
+        'form': PublisherSearchForm(request.GET),
+        'search_page': page,
+    })
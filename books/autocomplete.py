@@ -0,0 +1,228 @@
+"""
+In-memory type-ahead index of author and publisher names.
+
+Each process keeps, per kind, one sorted list of (normalized name, pk)
+entries. A lookup is a binary search for the prefix followed by a short
+forward scan, so it costs microseconds and no query. Authors are entered
+under "first last" and "last first" so either can be typed.
+
+The index is loaded on first use with one query. Saves and deletes made
+by this process update it straight away (the signals in
+books/signals.py). What other processes write (other web workers,
+run_worker imports, remove_author) is picked up at most every
+BOOKS_AUTOCOMPLETE_TTL seconds: rows whose updated_at moved since the
+last look are added again, and when the "autocomplete:<kind>"
+ReferenceVersion row shows something was deleted the index is loaded
+again in full. Both are read from default, like books/reference.py.
+
+It holds at most BOOKS_AUTOCOMPLETE_MAX_ENTRIES names; past that it
+stops growing, marks itself incomplete and lookups go to the database
+instead.
+"""
+import bisect
+import datetime
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+
+VERSION_NAME = "autocomplete:%s"
+
+# Rows committed a little after we looked can carry an older updated_at
+# (set when they were saved, or by another machine's clock)
+OVERLAP = datetime.timedelta(seconds=5)
+
+
+def normalize(text):
+    """Lower case, no accents, single spaces: what both names and typed prefixes are compared as."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.casefold().split())
+
+
+def author_entry(author):
+    label = f"{author.first_name} {author.last_name}".strip()
+    keys = {normalize(label), normalize(f"{author.last_name} {author.first_name}")}
+    return label, keys
+
+
+def publisher_entry(publisher):
+    return publisher.name, {normalize(publisher.name)}
+
+
+class PrefixIndex:
+    """Sorted array of (key, pk) pairs with the display label of every pk."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.complete = True
+        # Where the index is at: deletes version, time of the last look for changes
+        self.version = None
+        self.since = None
+        self.checked_at = 0.0
+        self._entries = []
+        self._keys = {}
+        self._labels = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, rows):
+        """Replaces the contents with (pk, label, keys) rows."""
+        entries = []
+        labels = {}
+        keys_by_pk = {}
+        complete = True
+        for pk, label, keys in rows:
+            if len(entries) + len(keys) > self.max_entries:
+                complete = False
+                break
+            labels[pk] = label
+            keys_by_pk[pk] = keys
+            entries.extend((key, pk) for key in keys)
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._labels = labels
+            self._keys = keys_by_pk
+            self.complete = complete
+
+    def add(self, pk, label, keys):
+        with self._lock:
+            self._remove(pk)
+            if len(self._entries) + len(keys) > self.max_entries:
+                self.complete = False
+                return
+            self._labels[pk] = label
+            self._keys[pk] = keys
+            for key in keys:
+                bisect.insort(self._entries, (key, pk))
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def _remove(self, pk):
+        for key in self._keys.pop(pk, ()):
+            i = bisect.bisect_left(self._entries, (key, pk))
+            if i < len(self._entries) and self._entries[i] == (key, pk):
+                del self._entries[i]
+        self._labels.pop(pk, None)
+
+    def lookup(self, prefix, limit):
+        """Returns up to `limit` (pk, label) pairs whose name starts with `prefix`, in name order."""
+        prefix = normalize(prefix)
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect.bisect_left(self._entries, (prefix,))
+            while i < len(self._entries) and len(results) < limit:
+                key, pk = self._entries[i]
+                if not key.startswith(prefix):
+                    break
+                if pk not in seen:
+                    seen.add(pk)
+                    results.append((pk, self._labels[pk]))
+                i += 1
+        return results
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _sources():
+    from books.models import Author, Publisher
+
+    return {
+        "author": (Author.objects.using(DEFAULT_DB_ALIAS).only("id", "first_name", "last_name"), author_entry),
+        "publisher": (Publisher.objects.using(DEFAULT_DB_ALIAS).only("id", "name"), publisher_entry),
+    }
+
+
+def _version(kind):
+    from books.models import ReferenceVersion
+
+    return ReferenceVersion.current(VERSION_NAME % kind)
+
+
+def _refresh(kind, index):
+    """Returns the index brought up to date with the database, a new one if it has to be reloaded."""
+    version = _version(kind)
+    queryset, entry = _sources()[kind]
+    started = timezone.now()
+    if index is None or index.version != version:
+        index = PrefixIndex(getattr(settings, "BOOKS_AUTOCOMPLETE_MAX_ENTRIES", 500_000))
+        index.load((obj.pk, *entry(obj)) for obj in queryset.iterator(chunk_size=5000))
+    else:
+        for obj in queryset.filter(updated_at__gte=index.since - OVERLAP):
+            index.add(obj.pk, *entry(obj))
+    index.version = version
+    index.since = started
+    index.checked_at = time.monotonic()
+    return index
+
+
+def get_index(kind):
+    """Returns this process's index for "author" or "publisher", loading or refreshing it when it is time to."""
+    ttl = getattr(settings, "BOOKS_AUTOCOMPLETE_TTL", 10)
+    index = _indexes.get(kind)
+    if index is not None and time.monotonic() - index.checked_at < ttl:
+        return index
+    with _indexes_lock:
+        index = _indexes.get(kind)
+        if index is None or time.monotonic() - index.checked_at >= ttl:
+            index = _indexes[kind] = _refresh(kind, index)
+        return index
+
+
+def reset():
+    """Forgets every loaded index, the next lookup reloads it."""
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def update(kind, objects):
+    """Called after saves: refreshes the entries of loaded indexes only."""
+    index = _indexes.get(kind)
+    if index is None:
+        return
+    entry = _sources()[kind][1]
+    for obj in objects:
+        index.add(obj.pk, *entry(obj))
+
+
+def remove(kind, pks):
+    """Called after deletes: tells other processes to reload, and forgets the pks here."""
+    from books.models import ReferenceVersion
+
+    ReferenceVersion.bump(VERSION_NAME % kind)
+    index = _indexes.get(kind)
+    if index is not None:
+        for pk in pks:
+            index.remove(pk)
+
+
+def lookup(kind, prefix, limit):
+    """(pk, label) suggestions, from memory or, if the index is incomplete, the database."""
+    index = get_index(kind)
+    if index.complete:
+        return index.lookup(prefix, limit)
+
+    from django.db.models import Q
+
+    queryset, entry = _sources()[kind]
+    if kind == "author":
+        words = prefix.split()
+        condition = Q(first_name__istartswith=prefix) | Q(last_name__istartswith=prefix)
+        if len(words) > 1:
+            condition |= Q(first_name__istartswith=words[0], last_name__istartswith=" ".join(words[1:]))
+        queryset = queryset.filter(condition).order_by("last_name", "first_name", "id")
+    else:
+        queryset = queryset.filter(name__istartswith=prefix).order_by("name", "id")
+    return [(obj.pk, entry(obj)[0]) for obj in queryset[:limit]]
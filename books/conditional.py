@@ -0,0 +1,138 @@
+"""
+Conditional GET (ETag / Last-Modified) for the catalog pages.
+
+A page's validators come from one query: the "catalog" ReferenceVersion
+row, whose version is the time rows last left a set (see below),
+annotated with the newest updated_at of each set of rows the page
+shows. Saves move updated_at, and changes to a
+book's authors touch the books and authors on both ends. A row leaving a
+set doesn't change the newest updated_at of the rows that stay, so
+whatever takes rows out of a set moves the catalog version instead:
+deletes, a book moving to another classification or publisher, and the
+sync replacing author lists (see books/signals.py). Between them any
+change to what the page shows changes its validators.
+
+The query goes to the database the page reads from (the replica, see
+mysite/replica.py), so the validators describe the rows the page shows.
+
+The user is part of both validators because the pages show who is logged
+in: the ETag includes the user id and Last-Modified is never older than
+the user's last login.
+
+When the client's copy is still good the view is not called at all and a
+304 goes back before any template is rendered. Works on async views too
+(books/async_views.py).
+"""
+import datetime
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.db import DEFAULT_DB_ALIAS, router
+from django.db.models import Subquery
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from books.models import Book, ReferenceVersion
+
+
+CATALOG = "catalog"
+
+
+def newest(queryset):
+    """Scalar subquery: the newest updated_at of the queryset's rows."""
+    return Subquery(queryset.order_by("-updated_at").values("updated_at")[:1])
+
+
+def bump_catalog():
+    """Records that rows left a set: a delete, a move, replaced links."""
+    ReferenceVersion.bump(CATALOG)
+
+
+def _state_rows(subqueries, using=None):
+    if using is None:
+        using = router.db_for_read(Book)
+    return ReferenceVersion.objects.using(using).filter(name=CATALOG).annotate(**subqueries).values("version", *subqueries)
+
+
+def catalog_state(**subqueries):
+    """(catalog version, {name: newest updated_at or None}) in one query."""
+    row = _state_rows(subqueries).first()
+    if row is None:
+        bump_catalog()  # Nothing deleted yet since the row was lost
+        row = _state_rows(subqueries, DEFAULT_DB_ALIAS).first()
+    version = row.pop("version")
+    return version, row
+
+
+async def acatalog_state(**subqueries):
+    row = await _state_rows(subqueries).afirst()
+    if row is None:
+        await sync_to_async(bump_catalog)()
+        row = await _state_rows(subqueries, DEFAULT_DB_ALIAS).afirst()
+    version = row.pop("version")
+    return version, row
+
+
+def validators(request, version, stamps):
+    """(ETag, Last-Modified as a datetime) of a page."""
+    deleted_at = datetime.datetime.fromtimestamp(version / 1e9, tz=datetime.timezone.utc)
+    times = [stamp for stamp in stamps.values() if stamp is not None] + [deleted_at]
+    user = request.user
+    if user.is_authenticated and user.last_login:
+        times.append(user.last_login)
+    last_modified = max(times).replace(microsecond=0)
+
+    parts = [str(user.pk), str(version)] + [
+        f"{name}={stamp.isoformat() if stamp else '-'}" for name, stamp in sorted(stamps.items())
+    ]
+    etag = hashlib.md5("|".join(parts).encode(), usedforsecurity=False).hexdigest()
+    return quote_etag(etag), last_modified
+
+
+def _check(request, version, stamps):
+    """(ETag, Last-Modified, the 304/412 response or None)."""
+    etag, last_modified = validators(request, version, stamps)
+    # HTTP dates have whole seconds, so Last-Modified is rounded down.
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    return etag, last_modified, response
+
+
+def _add_validators(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response.headers.setdefault("ETag", etag)
+        response.headers.setdefault("Last-Modified", http_date(last_modified.timestamp()))
+    return response
+
+
+def conditional_page(state):
+    """
+    View decorator. state(request, *args, **kwargs) returns the {name:
+    newest(queryset)} subqueries of the rows the page shows.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ("GET", "HEAD"):
+                    return await view(request, *args, **kwargs)
+                # The user is loaded lazily, which can't happen in the event loop
+                await sync_to_async(lambda: request.user.is_authenticated)()
+                version, stamps = await acatalog_state(**state(request, *args, **kwargs))
+                etag, last_modified, response = _check(request, version, stamps)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _add_validators(response, etag, last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            version, stamps = catalog_state(**state(request, *args, **kwargs))
+            etag, last_modified, response = _check(request, version, stamps)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _add_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
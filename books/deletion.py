@@ -0,0 +1,164 @@
+"""
+Chunked deletion of a publisher and the books that cascade from it.
+
+Letting Django cascade the delete loads every book and Book.authors row
+into memory and removes them all in one transaction, which keeps SQLite
+locked for the whole run. Here the books are removed BOOKS_DELETE_CHUNK_SIZE
+at a time, each chunk in its own short transaction together with the
+progress on its DeletionTask. The publisher row goes last.
+
+Every step only deletes what is still there, so an interrupted task is
+resumed by running it again (see the resume_deletions command). A runner
+claims the task with a conditional UPDATE first, so a task is never run
+twice at the same time. A chunk that finds the database locked by another
+writer is tried again.
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from books import jobs
+from books.models import Book, DeletionTask, Job, Publisher
+from mysite.sqlite.retry import retry_on_locked
+
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_size():
+    return getattr(settings, "BOOKS_DELETE_CHUNK_SIZE", 500)
+
+
+def start_publisher_deletion(publisher):
+    """
+    Records a DeletionTask for `publisher` and runs it: inline when it fits
+    in one chunk, otherwise as a delete_publisher job. Returns the task.
+    """
+    task = DeletionTask.objects.create(
+        publisher_id=publisher.pk,
+        publisher_name=publisher.name,
+        total_books=Book.objects.filter(publisher_id=publisher.pk).count(),
+    )
+    background = getattr(settings, "BOOKS_BACKGROUND_DELETION", True)
+    if background and task.total_books > chunk_size():
+        jobs.enqueue("delete_publisher", {"task_id": task.pk})
+    else:
+        run_task(task)
+    return task
+
+
+def delete_rows(model, pks):
+    """
+    Deletes the rows of `model` with these primary keys in one DELETE and
+    sends bulk_deleted for them. Returns the number of rows deleted.
+
+    QuerySet.delete() can't do this for the catalog models: they have
+    post_delete receivers, so the delete collector loads every row and
+    sends a signal per row, each costing queries of its own. Here there is
+    no collector, so no cascades either: delete whatever points at the
+    rows first.
+    """
+    from books.signals import bulk_deleted
+
+    pks = list(pks)
+    if not pks:
+        return 0
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(model._meta.db_table)} WHERE {quote(model._meta.pk.column)} "
+            f"IN ({', '.join(['%s'] * len(pks))})",
+            pks,
+        )
+        deleted = cursor.rowcount
+    bulk_deleted.send(sender=model, pks=pks)
+    return deleted
+
+
+def delete_chunk(publisher_id, size):
+    """Deletes up to `size` books of the publisher with their author links. Returns the number of books."""
+    ids = list(
+        Book.objects.filter(publisher_id=publisher_id).order_by("id").values_list("id", flat=True)[:size]
+    )
+    if not ids:
+        return 0
+    Book.authors.through.objects.filter(book_id__in=ids).delete()
+    delete_rows(Book, ids)
+    return len(ids)
+
+
+def claim_task(task):
+    """
+    Moves the task to running, unless it changed since it was read: then
+    another runner has it. Returns whether the task was claimed.
+    """
+    now = timezone.now()
+    claimed = DeletionTask.objects.filter(
+        pk=task.pk, status=task.status, updated_at=task.updated_at
+    ).update(status=DeletionTask.RUNNING, updated_at=now)
+    if claimed:
+        task.status, task.updated_at = DeletionTask.RUNNING, now
+    return bool(claimed)
+
+
+def run_task(task, on_progress=None):
+    """
+    Runs (or resumes) a DeletionTask to the end, calling on_progress(task)
+    after every chunk. Errors are recorded on the task and re-raised. A
+    task that changed since it was read is left to whoever changed it and
+    returned as it is.
+    """
+    if task.status == DeletionTask.DONE or not claim_task(task):
+        return task
+    size = chunk_size()
+
+    def next_chunk():
+        done = task.deleted_books
+        try:
+            with transaction.atomic():
+                deleted = delete_chunk(task.publisher_id, size)
+                if deleted:
+                    task.deleted_books = done + deleted
+                    task.save(update_fields=["deleted_books", "updated_at"])
+                return deleted
+        except Exception:
+            task.deleted_books = done  # Rolled back
+            raise
+
+    def finish():
+        with transaction.atomic():
+            # Nothing refers to it any more, a normal delete is cheap now
+            Publisher.objects.filter(pk=task.publisher_id).delete()
+            task.status = DeletionTask.DONE
+            task.finished_at = timezone.now()
+            task.save(update_fields=["status", "finished_at", "updated_at"])
+
+    try:
+        while retry_on_locked(next_chunk):
+            logger.info("%s: %d/%d books deleted", task, task.deleted_books, task.total_books)
+            if on_progress is not None:
+                on_progress(task)
+        retry_on_locked(finish)
+    except Exception as exc:
+        task.status = DeletionTask.FAILED
+        task.error = str(exc)
+        task.save(update_fields=["status", "error", "updated_at"])
+        logger.exception("%s failed", task)
+        raise
+    return task
+
+
+def unfinished_tasks():
+    """
+    Tasks nothing is working on: not done, and without a delete_publisher
+    job that is still queued or running (that job finishes them itself).
+    """
+    owned = [
+        job.args.get("task_id")
+        for job in Job.objects.filter(
+            kind="delete_publisher", status__in=[Job.QUEUED, Job.RUNNING]
+        ).only("args")
+    ]
+    return DeletionTask.objects.exclude(status=DeletionTask.DONE).exclude(pk__in=owned).order_by("id")
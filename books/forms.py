@@ -1,18 +1,36 @@
 from django import forms
 from .models import Book, Author, Publisher, Classification
+from .widgets import LazySelect, LazySelectMultiple
 from django.contrib.auth.models import User # For user registration. why? To create new users in the system.
 from django.contrib.auth.forms import UserCreationForm  
 
 class AuthorSearchForm(forms.Form):
-    query = forms.CharField(required=False, label="Search Author")
+    query = forms.CharField(
+        required=False,
+        label="Search Author",
+        widget=forms.TextInput(attrs={"data-autocomplete": "author", "autocomplete": "off"}),
+    )
 
 class PublisherSearchForm(forms.Form):
-    query = forms.CharField(required=False, label="Search Publisher")
+    query = forms.CharField(
+        required=False,
+        label="Search Publisher",
+        widget=forms.TextInput(attrs={"data-autocomplete": "publisher", "autocomplete": "off"}),
+    )
+
+class CatalogSearchForm(forms.Form):
+    query = forms.CharField(required=False, label="Search books, authors and publishers")
 
 class BookForm(forms.ModelForm):
     class Meta:
         model = Book
         fields = "__all__"
+        # Only the selected rows are rendered, the rest are looked up on demand
+        widgets = {
+            'authors': LazySelectMultiple('author'),
+            'publisher': LazySelect('publisher'),
+            'classification': LazySelect('classification'),
+        }
         error_messages = {
             'title': {'required': "Book title is required!"},
             'publication_date': {'invalid': "Enter a valid date in YYYY-MM-DD format."},
@@ -37,6 +55,32 @@ class AuthorForm(forms.ModelForm):
             'email': {'invalid': "Enter a valid email address."},
         }
 
+    def clean(self):
+        cleaned_data = super().clean()
+        first_name = cleaned_data.get("first_name")
+        last_name = cleaned_data.get("last_name")
+        if first_name is not None and last_name is not None:
+            # name_key is unique but not a form field, so check it here
+            key = Author.make_name_key(first_name, last_name)
+            if Author.objects.filter(name_key=key).exclude(pk=self.instance.pk).exists():
+                raise forms.ValidationError("An author with this name already exists!")
+        return cleaned_data
+
+
+class ImportJobForm(forms.Form):
+    search_term = forms.CharField(required=False, max_length=200, label="Search term")
+    limit = forms.IntegerField(required=False, min_value=1, label="Number of books")
+    incremental = forms.BooleanField(required=False, label="Only new and changed titles")
+
+    def job_args(self):
+        """Options for the add_books_from_api command"""
+        args = {"search_term": self.cleaned_data["search_term"]}
+        if self.cleaned_data["limit"]:
+            args["limit"] = self.cleaned_data["limit"]
+        if self.cleaned_data["incremental"]:
+            args["incremental"] = True
+        return args
+
 
 # Users and Authentication form
 class LoginForm(forms.Form):
@@ -0,0 +1,136 @@
+"""
+Cached HTML fragments of the catalog pages.
+
+Every fragment is stored together with the catalog version it was built
+from. The version is one number in the cache that the signals in
+books/signals.py bump whenever a Book, Author, Publisher or Classification
+(or a book's author list) changes, so a change makes every fragment stale
+at once without having to know which pages it shows up on.
+
+A stale or expired fragment is rebuilt by one request only: the first
+takes a short lock with cache.add() and rebuilds, the others keep serving
+the old copy meanwhile (or, if there is no copy at all, wait a moment for
+the one being built).
+
+Fragments are also keyed on the database the request reads the catalog
+from. A request that reads from the replica (mysite/replica.py) can
+build a fragment from a snapshot taken before the last write, under the
+version that write bumped. Sessions that just wrote read from default and
+so get their own copy, built from what they wrote. The replica's copies
+go stale when refresh_replica bumps the version.
+
+Hit and miss counters are kept per process, see stats().
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+
+from books.models import Book
+
+
+VERSION_KEY = "books:catalog-version"
+KEY_PREFIX = "books:fragment"
+
+_stats = {"hits": 0, "stale": 0, "waits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """A snapshot of this process's counters, with the hit rate."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+    served = sum(snapshot.values())
+    cached = snapshot["hits"] + snapshot["stale"] + snapshot["waits"]
+    snapshot["requests"] = served
+    snapshot["hit_rate"] = cached / served if served else None
+    return snapshot
+
+
+def reset_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def version():
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        # Start from the clock, not 1, so an evicted version can never come
+        # back to a number some old fragment was stored with.
+        cache.add(VERSION_KEY, time.time_ns() // 1000, None)
+        current = cache.get(VERSION_KEY)
+    return current
+
+
+def bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        version()  # Not set yet, a fresh one is as good as a bump
+
+
+def fragment_key(name, *parts):
+    digest = hashlib.md5(
+        "\x1f".join(str(part) for part in parts).encode(), usedforsecurity=False
+    ).hexdigest()
+    return f"{KEY_PREFIX}:{name}:{router.db_for_read(Book)}:{digest}"
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_or_build(key, build):
+    """Returns the cached fragment under `key`, calling build() if it has to be (re)built."""
+    timeout = _setting("BOOKS_FRAGMENT_CACHE_TIMEOUT", 300)
+    lock_timeout = _setting("BOOKS_FRAGMENT_CACHE_LOCK_TIMEOUT", 10)
+    current = version()
+    entry = cache.get(key)
+    lock_key = f"{key}:lock"
+
+    if entry is not None:
+        built_version, fresh_until, value = entry
+        if built_version == current and fresh_until > time.time():
+            _count("hits")
+            return value
+        if not cache.add(lock_key, 1, lock_timeout):
+            _count("stale")  # Someone else is rebuilding it
+            return value
+    elif not cache.add(lock_key, 1, lock_timeout):
+        value = _wait_for(key, current, lock_timeout)
+        if value is not None:
+            _count("waits")
+            return value
+        # Whoever held the lock is taking too long, build it ourselves
+        lock_key = None
+
+    _count("misses")
+    try:
+        value = build()
+        # Stale copies stay around for a while to be served during rebuilds
+        cache.set(key, (current, time.time() + timeout, value), timeout * 2)
+    finally:
+        if lock_key is not None:
+            cache.delete(lock_key)
+    return value
+
+
+def _wait_for(key, current, limit):
+    deadline = time.monotonic() + limit
+    delay = 0.01
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        entry = cache.get(key)
+        if entry is not None and entry[0] == current:
+            return entry[2]
+        delay = min(delay * 2, 0.2)
+    return None
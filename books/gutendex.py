@@ -0,0 +1,174 @@
+import json
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urljoin, urlparse, parse_qs
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from books.httpcache import CacheMiss
+
+
+DEFAULT_BASE_URL = 'https://gutendex.com/books/'
+
+
+class GutendexClient:
+    """
+    Streams book records from the Gutendex API (or a local copy of it).
+
+    The first page tells us how many results and pages there are, after
+    that up to `workers` pages are downloaded at the same time on a thread
+    pool sharing one pooled requests.Session. Pages are still yielded in
+    order, so the caller can write page N to the database while pages
+    N+1 .. N+workers are downloading.
+
+    `base_url` may also be a directory of fixture pages named
+    page-1.json, page-2.json, ... in the Gutendex response format, which is
+    what the tests and offline benchmarks use.
+
+    With a ResponseCache, pages are revalidated with If-None-Match /
+    If-Modified-Since and a 304 is answered from disk. With `offline=True`
+    the network is never used and a page missing from the cache raises
+    CacheMiss.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, workers=4, timeout=30, session=None,
+                 cache=None, offline=False):
+        self.base_url = base_url
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        if offline and cache is None:
+            raise ValueError('offline mode needs a response cache')
+        self.directory = self._local_directory(base_url)
+        if session is None and self.directory is None and not offline:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    @staticmethod
+    def _local_directory(base_url):
+        if base_url.startswith('file://'):
+            return urlparse(base_url).path
+        if '://' not in base_url and os.path.isdir(base_url):
+            return base_url
+        return None
+
+    def page_url(self, page, search='', sort=None):
+        if self.directory is not None:
+            return os.path.join(self.directory, f'page-{page}.json')
+        params = {}
+        if page > 1:
+            params['page'] = page
+        if search:
+            params['search'] = search
+        if sort:
+            params['sort'] = sort
+        if not params:
+            return self.base_url
+        return f'{self.base_url}?{urlencode(params)}'
+
+    def fetch(self, url):
+        """Returns the decoded JSON page at `url`."""
+        if self.directory is not None:
+            with open(url, encoding='utf-8') as fixture:
+                return json.load(fixture)
+        if self.cache is None:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+
+        cached = self.cache.get(url)
+        if self.offline:
+            if cached is None:
+                raise CacheMiss(f'{url} is not in the response cache')
+            return json.loads(cached.body)
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached is not None:
+            return json.loads(cached.body)
+        response.raise_for_status()
+        self.cache.put(
+            url,
+            response.content,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+        )
+        return json.loads(response.content)
+
+    def _next_url(self, page, current_url):
+        """Resolves the `next` link of a page, mapping it onto the fixture directory if needed."""
+        next_url = page.get('next')
+        if not next_url or self.directory is None:
+            return next_url
+        number = parse_qs(urlparse(next_url).query).get('page', [None])[0]
+        if number is not None:
+            return self.page_url(int(number))
+        return urljoin(current_url, next_url)
+
+    def iter_pages(self, search='', limit=None, sort=None):
+        """Yields result pages in order until `limit` records are covered or there is no `next` page."""
+        url = self.page_url(1, search, sort)
+        first = self.fetch(url)
+        yield first
+
+        page_size = len(first.get('results', []))
+        count = first.get('count')
+        if not first.get('next') or not page_size:
+            return
+        if count is None:
+            # No total to plan with, just follow the links one by one
+            yield from self._follow_next(first, url, limit, page_size)
+            return
+
+        last_page = math.ceil(count / page_size)
+        if limit is not None:
+            last_page = min(last_page, math.ceil(limit / page_size))
+
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='gutendex')
+        pending = deque()
+        next_page = 2
+        try:
+            while pending or next_page <= last_page:
+                while next_page <= last_page and len(pending) < self.workers:
+                    pending.append(pool.submit(self.fetch, self.page_url(next_page, search, sort)))
+                    next_page += 1
+                page = pending.popleft().result()
+                yield page
+                if not page.get('next'):
+                    break
+        finally:
+            # The consumer may stop early, don't wait for pages nobody will read
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _follow_next(self, page, url, limit, page_size):
+        seen = page_size
+        while page.get('next') and (limit is None or seen < limit):
+            url = self._next_url(page, url)
+            page = self.fetch(url)
+            seen += len(page.get('results', []))
+            yield page
+
+    def iter_books(self, search='', limit=None, sort=None):
+        """
+        Yields individual book records, at most `limit` of them. `sort` is
+        passed on to Gutendex ("ascending", "descending" or "popular").
+        """
+        yielded = 0
+        for page in self.iter_pages(search, limit, sort):
+            for record in page.get('results', []):
+                if limit is not None and yielded >= limit:
+                    return
+                yield record
+                yielded += 1
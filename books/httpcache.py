@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+
+CachedResponse = namedtuple('CachedResponse', ['url', 'body', 'etag', 'last_modified', 'stored_at'])
+
+SUFFIX = '.gz'
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a url has never been fetched."""
+
+
+class ResponseCache:
+    """
+    Persistent, size-bounded cache of HTTP response bodies keyed by url.
+
+    Every entry is one gzip file holding a JSON header line (url, ETag,
+    Last-Modified, time stored) followed by the raw body. The file mtime is
+    the "last used" time: hits touch it and, when the directory grows past
+    `max_bytes`, the least recently used files are removed first.
+
+    Writes go to a temporary file that is renamed into place, so readers in
+    other threads or processes never see a half written entry.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, url):
+        """Returns the CachedResponse for `url` or None, marking it as recently used."""
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as entry:
+                raw = gzip.decompress(entry.read())
+        except (OSError, EOFError):
+            return None
+        header, _, body = raw.partition(b'\n')
+        try:
+            meta = json.loads(header)
+        except ValueError:
+            return None
+        self.touch(url)
+        return CachedResponse(
+            url=meta['url'],
+            body=body,
+            etag=meta.get('etag'),
+            last_modified=meta.get('last_modified'),
+            stored_at=meta.get('stored_at'),
+        )
+
+    def put(self, url, body, etag=None, last_modified=None):
+        header = json.dumps({
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored_at': time.time(),
+        }).encode()
+        data = gzip.compress(header + b'\n' + body)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, self._path(url))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def touch(self, url):
+        try:
+            os.utime(self._path(url))
+        except OSError:
+            pass
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(SUFFIX):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
@@ -0,0 +1,209 @@
+"""
+A small job queue kept in the database, no broker needed.
+
+enqueue() adds a Job row. The run_worker command claims queued jobs with a
+conditional UPDATE (only one worker can move a job from queued to running)
+and runs them in a process pool. Each job kind has a handler registered
+with @handler; it gets the Job and its args, and reports progress with
+JobProgress so staff can follow it on the jobs page.
+
+How many jobs of each kind may run at once, across all workers, is set by
+BOOKS_JOB_CONCURRENCY. Kinds that are not listed are only limited by the
+size of the pool.
+"""
+import logging
+import os
+import socket
+import time
+import traceback
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from books.models import Job
+from mysite.sqlite.retry import retry_on_locked
+
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+class UnknownJobKind(Exception):
+    pass
+
+
+def handler(kind):
+    """Registers a function(job, **args) as the handler of a job kind."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, args=None, user=None):
+    if kind not in HANDLERS:
+        raise UnknownJobKind(kind)
+    return Job.objects.create(kind=kind, args=args or {}, created_by=user)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def concurrency_limits():
+    return getattr(settings, "BOOKS_JOB_CONCURRENCY", {})
+
+
+def claim_next(worker, kinds=None):
+    """
+    Moves the oldest queued job that may run now to running and returns it,
+    or None. Safe to call from several workers at once.
+    """
+    # Counting the running jobs and claiming one is a single write
+    # transaction (BEGIN IMMEDIATE, see DATABASES), so two workers can't
+    # both see a kind below its limit and both claim a job of it.
+    return retry_on_locked(lambda: _claim_next(worker, kinds))
+
+
+def _claim_next(worker, kinds):
+    with transaction.atomic():
+        limits = concurrency_limits()
+        running = dict(
+            Job.objects.filter(status=Job.RUNNING).values_list("kind").annotate(n=Count("id")).order_by()
+        )
+        full = [kind for kind, limit in limits.items() if running.get(kind, 0) >= limit]
+        queued = Job.objects.filter(status=Job.QUEUED).exclude(kind__in=full)
+        if kinds:
+            queued = queued.filter(kind__in=kinds)
+        for job_id in queued.order_by("id").values_list("id", flat=True)[:10]:
+            # Whoever flips the status first owns the job
+            claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+                status=Job.RUNNING, worker=worker, started_at=timezone.now()
+            )
+            if claimed:
+                return Job.objects.get(id=job_id)
+        return None
+
+
+def requeue_running(worker):
+    """
+    Puts the jobs a worker left running back in the queue. Returns how many.
+    Only for a worker that is gone: the jobs of a live one would run twice.
+    """
+    return Job.objects.filter(status=Job.RUNNING, worker=worker).update(
+        status=Job.QUEUED, worker="", started_at=None
+    )
+
+
+class JobProgress:
+    """
+    Writes progress to the job row, at most every `interval` seconds.
+
+    It is also a file-like object: management commands can be given it as
+    stdout, their output is kept on the job and the last line is shown as
+    the message.
+    """
+
+    def __init__(self, job, interval=1.0):
+        self.job = job
+        self.interval = interval
+        self._lines = []
+        self._partial = ""
+        self._saved_at = 0.0
+
+    def update(self, progress=None, total=None, message=None, force=False):
+        if progress is not None:
+            self.job.progress = progress
+        if total is not None:
+            self.job.total = total
+        if message is not None:
+            self.job.message = message[:200]
+        if force or time.monotonic() - self._saved_at >= self.interval:
+            self.save()
+
+    def save(self):
+        self._saved_at = time.monotonic()
+        Job.objects.filter(pk=self.job.pk).update(
+            progress=self.job.progress,
+            total=self.job.total,
+            message=self.job.message,
+            output="\n".join(self._lines),
+        )
+
+    def write(self, text):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._lines.append(line)
+            if line.strip():
+                self.update(message=line.strip())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._partial:
+            self.write("\n")
+        self.save()
+
+
+def execute(job_id):
+    """Runs one claimed job to the end and records the outcome. Returns the final status."""
+    job = Job.objects.get(id=job_id)
+    progress = JobProgress(job)
+    try:
+        func = HANDLERS.get(job.kind)
+        if func is None:
+            raise UnknownJobKind(job.kind)
+        func(job, progress, **job.args)
+    except Exception as exc:
+        progress.close()
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED, error=f"{exc}\n\n{traceback.format_exc()}", finished_at=timezone.now()
+        )
+        logger.exception("%s failed", job)
+        return Job.FAILED
+    progress.close()
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now())
+    return Job.DONE
+
+
+def execute_in_process(job_id):
+    """execute() for a pool process, which must not reuse a connection between jobs."""
+    close_old_connections()
+    try:
+        return execute(job_id)
+    finally:
+        close_old_connections()
+
+
+# Handlers
+
+@handler("add_books_from_api")
+def add_books_from_api(job, progress, search_term="", **options):
+    call_command("add_books_from_api", search_term, stdout=progress, **options)
+
+
+@handler("remove_author")
+def remove_author(job, progress, author_ids, **options):
+    progress.update(total=len(author_ids), message=f"Removing {len(author_ids)} authors", force=True)
+    call_command("remove_author", *author_ids, stdout=progress, **options)
+    progress.update(progress=len(author_ids))
+
+
+@handler("delete_publisher")
+def delete_publisher(job, progress, task_id):
+    from books.deletion import run_task
+    from books.models import DeletionTask
+
+    task = DeletionTask.objects.get(id=task_id)
+
+    def report(task):
+        progress.update(task.deleted_books, task.total_books, f"{task.deleted_books} books deleted")
+
+    run_task(task, on_progress=report)
+    report(task)
@@ -1,7 +1,12 @@
+import time
+
 import requests
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from books.models import Author, Book, Publisher, Classification
-from datetime import datetime
+from books.gutendex import DEFAULT_BASE_URL, GutendexClient
+from books.httpcache import CacheMiss, ResponseCache
+from books.importer import BookImporter
+from books.sync import GutendexSync
 
 
 class Command(BaseCommand):
@@ -21,108 +26,161 @@ class Command(BaseCommand):
         parser.add_argument(
             '--limit',
             type=int,
-            default=10,
-            help='Number of books to import (default: 10)'
+            default=None,
+            help='Number of books to import (default: 10, unlimited with --incremental)'
+        )
+
+        # OPTIONAL: --batch-size flag
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of books written per transaction (default: 500)'
+        )
+
+        # OPTIONAL: --base-url flag
+        parser.add_argument(
+            '--base-url',
+            default=DEFAULT_BASE_URL,
+            help='Gutendex API url, or a directory of page-N.json fixture pages '
+                 f'(default: {DEFAULT_BASE_URL})'
+        )
+
+        # OPTIONAL: --workers flag
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of pages downloaded at the same time (default: 4)'
+        )
+
+        # OPTIONAL: response cache flags
+        parser.add_argument(
+            '--cache-dir',
+            default=settings.GUTENDEX_CACHE_DIR,
+            help='Directory of the on-disk response cache (default: GUTENDEX_CACHE_DIR setting)'
+        )
+        parser.add_argument(
+            '--no-cache',
+            action='store_true',
+            help='Always download, do not read or write the response cache'
+        )
+        parser.add_argument(
+            '--offline',
+            action='store_true',
+            help='Replay pages from the response cache only, never touch the network'
+        )
+
+        # OPTIONAL: incremental sync flags
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only fetch titles newer than the last sync of this search term and update changed ones'
+        )
+        parser.add_argument(
+            '--overlap',
+            type=int,
+            default=32,
+            help='With --incremental, already synced records re-checked for changes (default: 32)'
+        )
+
+        # OPTIONAL: --match-titles flag
+        parser.add_argument(
+            '--match-titles',
+            action='store_true',
+            help='Give books imported before Gutenberg ids were stored the id of the record '
+                 'with the same title. Run once over the catalog after upgrading.'
         )
 
     def handle(self, *args, **options): # what does this method do in this context? 
         limit = options['limit'] 
+        if limit is None and not options['incremental']:
+            limit = 10
         search_term = options['search_term']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        
+        if options['offline'] and options['no_cache']:
+            raise CommandError('--offline needs the response cache, drop --no-cache')
         
         try:
-            # Build API URL
-            url = 'https://gutendex.com/books/'
+            cache = None
+            if not options['no_cache']:
+                cache = ResponseCache(options['cache_dir'], max_bytes=settings.GUTENDEX_CACHE_MAX_BYTES)
+            client = GutendexClient(
+                options['base_url'],
+                workers=options['workers'],
+                cache=cache,
+                offline=options['offline'],
+            )
             if search_term:
-                url += f'?search={search_term}'
                 self.stdout.write(f'Fetching books matching "{search_term}"...')
             else:
                 self.stdout.write('Fetching books from Gutendex API...')
             
-            response = requests.get(url)
-            response.raise_for_status()
-            
-            data = response.json()
-            books_data = data.get('results', [])[:limit]
-            
-            if not books_data:
-                self.stdout.write(self.style.WARNING('No books found'))
+            if options['incremental']:
+                self.sync_books(client, search_term, batch_size, options['overlap'], options['match_titles'])
                 return
             
-            # Get or create default publisher and classification
-            publisher, _ = Publisher.objects.get_or_create(
-                name='Project Gutenberg',
-                defaults={
-                    'address': 'Unknown',
-                    'city': 'Unknown',
-                    'state_province': 'Unknown',
-                    'country': 'USA',
-                    'website': 'https://www.gutenberg.org'
-                }
-            )
-            
-            classification, _ = Classification.objects.get_or_create(
-                code='GUT',
-                defaults={
-                    'name': 'Gutenberg Collection',
-                    'description': 'Books from Project Gutenberg'
-                }
-            )
-            
-            books_created = 0
-            authors_created = 0
+            # Records are streamed: pages keep downloading while earlier ones are saved
+            books_data = client.iter_books(search_term, limit)
+            importer = self.import_books(books_data, batch_size, options['verbosity'], options['match_titles'])
             
-            # Process each book
-            for book_data in books_data:
-                title = book_data.get('title', 'Unknown Title')
-                
-                # Skip if book exists
-                if Book.objects.filter(title=title).exists():
-                    self.stdout.write(self.style.WARNING(f'"{title}" already exists, skipping...'))
-                    continue
-                
-                # Create book
-                book = Book.objects.create(
-                    title=title[:100],
-                    publisher=publisher,
-                    classification=classification,
-                    publication_date=datetime.now().date()
-                )
-                books_created += 1
-                
-                # Process authors
-                for author_data in book_data.get('authors', []):
-                    name = author_data.get('name', 'Unknown')
-                    
-                    # Parse name: "Last, First" or "First Last"
-                    if ', ' in name:
-                        last_name, first_name = name.split(', ', 1)
-                    else:
-                        parts = name.split(' ', 1)
-                        first_name = parts[0]
-                        last_name = parts[1] if len(parts) > 1 else ''
-                    
-                    # Get or create author
-                    author, created = Author.objects.get_or_create(
-                        first_name=first_name[:30],
-                        last_name=last_name[:40],
-                        defaults={'email': f'{first_name.lower()}@gutenberg.org'[:254]}
-                    )
-                    
-                    if created:
-                        authors_created += 1
-                    
-                    book.authors.add(author)
-                
-                self.stdout.write(self.style.SUCCESS(f'✓ "{title}"'))
-            
-            # Summary
-            self.stdout.write(self.style.SUCCESS(
-                f'\n=== Complete ==='
-                f'\nBooks: {books_created}'
-                f'\nAuthors: {authors_created}'
-            ))
+            if not importer.books_saved and not importer.skipped:
+                self.stdout.write(self.style.WARNING('No books found'))
             
         except requests.RequestException as e:
             raise CommandError(f'API error: {e}')
+        except CacheMiss as e:
+            raise CommandError(f'Offline: {e}')
         except Exception as e:
             raise CommandError(f'Error: {e}')
+
+    def import_books(self, books_data, batch_size, verbosity=1, match_titles=False):
+        """Writes the records in batches and prints a summary with the throughput."""
+        importer = BookImporter(batch_size=batch_size, match_titles=match_titles)
+        records = 0
+        started = time.perf_counter()
+
+        def counted(items):
+            nonlocal records
+            for item in items:
+                records += 1
+                yield item
+
+        for books in importer.import_records(counted(books_data)):
+            if verbosity > 1:
+                for book in books:
+                    self.stdout.write(self.style.SUCCESS(f'✓ "{book.title}"'))
+            elif books:
+                self.stdout.write(f'Saved {len(books)} books ({records} records read)')
+
+        elapsed = time.perf_counter() - started
+        rate = records / elapsed if elapsed > 0 else 0
+
+        # Summary
+        self.stdout.write(self.style.SUCCESS(
+            f'\n=== Complete ==='
+            f'\nBooks: {importer.books_saved}'
+            f'\nAuthors: {importer.authors_saved}'
+            f'\nSkipped (duplicate or missing id): {importer.skipped}'
+            f'\nRecords: {records} in {elapsed:.2f}s ({rate:.0f} rows/sec)'
+        ))
+        return importer
+
+    def sync_books(self, client, search_term, batch_size, overlap, match_titles=False):
+        """Runs an incremental sync of the search term and prints what changed."""
+        started = time.perf_counter()
+        importer = BookImporter(batch_size=batch_size, match_titles=match_titles)
+        sync = GutendexSync(client, importer, search_term, overlap)
+        state = sync.run()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'\n=== Sync complete ==='
+            f'\nNew: {sync.created}'
+            f'\nUpdated: {sync.updated}'
+            f'\nUnchanged: {sync.unchanged}'
+            f'\nWatermark: {state.watermark} ({elapsed:.2f}s)'
+        ))
+        return sync
@@ -0,0 +1,163 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from mysite.sqlite import retry
+from mysite.sqlite.base import PRAGMAS
+
+
+class Command(BaseCommand):
+    help = ('Compares concurrent readers and writers on a scratch SQLite database with the plain '
+            'settings and with the profile of mysite/sqlite/base.py')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5, help='Length of each run (default: 5)')
+        parser.add_argument('--readers', type=int, default=8, help='Reader threads, like request workers (default: 8)')
+        parser.add_argument('--writers', type=int, default=2, help='Writer threads, like importers (default: 2)')
+        parser.add_argument('--batch', type=int, default=100, help='Rows written per write transaction (default: 100)')
+        parser.add_argument('--rows', type=int, default=20000, help='Rows in the table to begin with (default: 20000)')
+        parser.add_argument(
+            '--profile',
+            choices=['both', 'plain', 'tuned'],
+            default='both',
+            help='"plain": rollback journal, deferred transactions, a connection per read. '
+                 '"tuned": WAL and the other pragmas, BEGIN IMMEDIATE, retries, persistent connections.'
+        )
+
+    def handle(self, *args, **options):
+        if options['readers'] < 0 or options['writers'] < 0 or options['readers'] + options['writers'] < 1:
+            raise CommandError('Need at least one reader or writer')
+        profiles = ['plain', 'tuned'] if options['profile'] == 'both' else [options['profile']]
+        self.stdout.write(
+            f"{'profile':<8} {'reads/s':>9} {'read p99 ms':>12} {'writes/s':>9} "
+            f"{'write p99 ms':>13} {'locked':>7}"
+        )
+        for profile in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                self.seed(path, options['rows'], wal=profile == 'tuned')
+                result = self.run(path, profile == 'tuned', options)
+            self.stdout.write(
+                f"{profile:<8} {result['reads'] / result['elapsed']:>9.1f} {result['read_p99'] * 1000:>12.2f} "
+                f"{result['writes'] / result['elapsed']:>9.1f} {result['write_p99'] * 1000:>13.2f} "
+                f"{result['locked']:>7}"
+            )
+
+    def seed(self, path, rows, wal):
+        conn = sqlite3.connect(path)
+        if wal:
+            conn.execute('PRAGMA journal_mode = wal')  # What migrate does (books 0013)
+        conn.execute('CREATE TABLE books_book (id INTEGER PRIMARY KEY, title TEXT NOT NULL, updated_at TEXT NOT NULL)')
+        conn.execute('CREATE INDEX books_book_title ON books_book (title, id)')
+        conn.executemany(
+            'INSERT INTO books_book (title, updated_at) VALUES (?, ?)',
+            ((f'Title {random.random():.12f}', '2024-01-01') for _ in range(rows)),
+        )
+        conn.commit()
+        conn.close()
+
+    def connect(self, path, tuned):
+        # Like Django: autocommit, transactions opened with an explicit BEGIN
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        if tuned:
+            for name, value in PRAGMAS.items():
+                conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def run(self, path, tuned, options):
+        stop = threading.Event()
+        lock = threading.Lock()
+        reads, writes = [], []
+        locked = [0]
+
+        def reader():
+            conn = self.connect(path, tuned) if tuned else None
+            while not stop.is_set():
+                started = time.perf_counter()
+                # Without CONN_MAX_AGE every request opens its own connection
+                current = conn or self.connect(path, tuned)
+                try:
+                    # One page of the book list
+                    current.execute(
+                        'SELECT id, title FROM books_book WHERE title > ? ORDER BY title, id LIMIT 51',
+                        (f'Title {random.random():.12f}',),
+                    ).fetchall()
+                except sqlite3.OperationalError:
+                    with lock:
+                        locked[0] += 1
+                    continue
+                finally:
+                    if conn is None:
+                        current.close()
+                with lock:
+                    reads.append(time.perf_counter() - started)
+            if conn is not None:
+                conn.close()
+
+        def write_batch(conn):
+            conn.execute('BEGIN IMMEDIATE' if tuned else 'BEGIN')
+            try:
+                # Read then write, like an upsert followed by reading the ids back
+                (newest,) = conn.execute('SELECT MAX(id) FROM books_book').fetchone()
+                conn.executemany(
+                    'INSERT INTO books_book (title, updated_at) VALUES (?, ?)',
+                    ((f'Title {random.random():.12f}', '2024-01-02') for _ in range(options['batch'])),
+                )
+                conn.execute('UPDATE books_book SET updated_at = ? WHERE id > ?', ('2024-01-03', newest))
+                conn.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+
+        def writer():
+            conn = self.connect(path, tuned)
+            while not stop.is_set():
+                started = time.perf_counter()
+                attempts = retry.ATTEMPTS if tuned else 1
+                for attempt in range(attempts):
+                    try:
+                        write_batch(conn)
+                        break
+                    except sqlite3.OperationalError as exc:
+                        if 'locked' not in str(exc):
+                            raise
+                        with lock:
+                            locked[0] += 1
+                        if attempt < attempts - 1:
+                            time.sleep(retry.BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+                else:
+                    continue
+                with lock:
+                    writes.append(time.perf_counter() - started)
+            conn.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer) for _ in range(options['writers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return {
+            'elapsed': elapsed,
+            'reads': len(reads),
+            'writes': len(writes),
+            'read_p99': p99(reads),
+            'write_p99': p99(writes),
+            'locked': locked[0],
+        }
+
+
+def p99(latencies):
+    if not latencies:
+        return 0.0
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from books.models import Author, Book, Classification
+
+
+class Command(BaseCommand):
+    help = ('Compares requests/sec and latency of the catalog pages served through WSGI (sync views) '
+            'and ASGI (async views) under concurrent load')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode',
+            choices=['both', 'wsgi', 'asgi'],
+            default='both',
+            help='Handler to benchmark. "both" runs each in a fresh process, '
+                 'with BOOKS_ASYNC_VIEWS off for WSGI and on for ASGI (default)'
+        )
+        parser.add_argument('--requests', type=int, default=500, help='Requests per page (default: 500)')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once (default: 20)')
+        parser.add_argument('--username', help='User the pages are requested as (default: the first superuser)')
+        parser.add_argument(
+            '--path',
+            action='append',
+            help='Page to request (can be repeated, default: the catalog read pages)'
+        )
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1')
+        if options['mode'] == 'both':
+            results = [self.run_child(mode, options) for mode in ('wsgi', 'asgi')]
+        else:
+            results = [self.run(options['mode'], options)]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{'mode':<6} {'views':<6} {'path':<40} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        for result in results:
+            for page in result['pages']:
+                self.stdout.write(
+                    f"{result['mode']:<6} {result['views']:<6} {page['path']:<40} {page['rps']:>8.1f} "
+                    f"{page['p50_ms']:>8.2f} {page['p99_ms']:>8.2f} {page['errors']:>6}"
+                )
+
+    def run_child(self, mode, options):
+        # Each handler gets its own process: the urls are picked when they are imported
+        env = dict(os.environ, BOOKS_ASYNC_VIEWS='1' if mode == 'asgi' else '0')
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_views',
+            '--mode', mode, '--json',
+            '--requests', str(options['requests']),
+            '--concurrency', str(options['concurrency']),
+        ]
+        if options['username']:
+            command += ['--username', options['username']]
+        for path in options['path'] or []:
+            command += ['--path', path]
+        child = subprocess.run(command, env=env, capture_output=True, text=True)
+        if child.returncode:
+            raise CommandError(f'{mode} benchmark failed:\n{child.stderr}')
+        return json.loads(child.stdout)[0]
+
+    def run(self, mode, options):
+        cookie = self.session_cookie(options['username'])
+        paths = options['path'] or self.default_paths()
+        connection.close()  # Every thread opens its own
+        pages = []
+        for path in paths:
+            if mode == 'wsgi':
+                latencies, errors, elapsed = self.load_wsgi(path, cookie, options)
+            else:
+                latencies, errors, elapsed = asyncio.run(self.load_asgi(path, cookie, options))
+            latencies.sort()
+            pages.append({
+                'path': path,
+                'rps': len(latencies) / elapsed,
+                'p50_ms': latencies[len(latencies) // 2] * 1000,
+                'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+                'errors': errors,
+            })
+        views = 'async' if getattr(settings, 'BOOKS_ASYNC_VIEWS', False) else 'sync'
+        return {'mode': mode, 'views': views, 'pages': pages}
+
+    def session_cookie(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = User.objects.filter(is_superuser=True, is_active=True).order_by('id').first()
+        if user is None:
+            raise CommandError('No such user, pass --username')
+        client = Client()
+        client.force_login(user)
+        return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    def default_paths(self):
+        paths = [reverse('book_list'), reverse('classification_list'), reverse('author_list')]
+        book = Book.objects.order_by('id').first()
+        author = Author.objects.order_by('id').first()
+        classification = Classification.objects.order_by('id').first()
+        if book:
+            paths.append(reverse('book_detail', args=[book.id]))
+        if author:
+            paths.append(reverse('author_detail', args=[author.id]))
+        if classification:
+            paths.append(reverse('classification_detail', args=[classification.id]))
+        return paths
+
+    # WSGI: a thread per request in flight, like a threaded WSGI server
+
+    def load_wsgi(self, path, cookie, options):
+        handler = WSGIHandler()
+        lock = threading.Lock()
+        remaining = [options['requests']]
+        latencies, errors = [], [0]
+
+        def request():
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'HTTP_COOKIE': cookie,
+                'HTTP_HOST': 'localhost', 'wsgi.input': BytesIO(),
+            }
+            setup_testing_defaults(environ)
+            status = []
+            started = time.perf_counter()
+            body = handler(environ, lambda code, headers, exc_info=None: status.append(code))
+            try:
+                for _ in body:
+                    pass
+            finally:
+                body.close()
+            return time.perf_counter() - started, status[0].startswith('200')
+
+        def worker():
+            while True:
+                with lock:
+                    if not remaining[0]:
+                        break
+                    remaining[0] -= 1
+                latency, ok = request()
+                with lock:
+                    latencies.append(latency)
+                    errors[0] += not ok
+            connection.close()
+
+        request()  # Warm up
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            for future in [pool.submit(worker) for _ in range(options['concurrency'])]:
+                future.result()
+        return latencies, errors[0], time.perf_counter() - started
+
+    # ASGI: one event loop, a task per request in flight
+
+    async def load_asgi(self, path, cookie, options):
+        handler = ASGIHandler()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        remaining = [options['requests']]
+        latencies, errors = [], [0]
+
+        async def request():
+            sent = []
+            status = []
+
+            async def receive():
+                if not sent:
+                    sent.append(True)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await asyncio.Event().wait()  # The client never goes away
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            started = time.perf_counter()
+            await handler(dict(scope), receive, send)
+            return time.perf_counter() - started, status[0] == 200
+
+        async def worker():
+            while remaining[0]:
+                remaining[0] -= 1
+                latency, ok = await request()
+                latencies.append(latency)
+                errors[0] += not ok
+
+        await request()  # Warm up
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(options['concurrency'])])
+        return latencies, errors[0], time.perf_counter() - started
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from books import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of books, authors and publishers'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Full-text search needs SQLite with FTS5')
+        with transaction.atomic():
+            documents = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {documents} documents'))
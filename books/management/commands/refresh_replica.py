@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import fragments
+from mysite import replica
+
+
+class Command(BaseCommand):
+    help = 'Copies the database into the read replica the catalog pages read from (see mysite/replica.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages',
+            type=int,
+            default=-1,
+            help='Pages copied per step, -1 copies everything in one step (default). '
+                 'Smaller steps let readers of the replica in between, '
+                 'but a write to the database makes the copy start over.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def progress(status, remaining, total):
+            self.stdout.write(f'{total - remaining}/{total} pages copied')
+
+        try:
+            path = replica.refresh(options['pages'], progress if options['verbosity'] > 1 else None)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        # Fragments cached from the old copy would outlive it
+        fragments.bump()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {path} in {time.monotonic() - started:.1f}s'))
@@ -1,40 +1,96 @@
+import sys
+
 from django.core.management.base import BaseCommand, CommandError
-from books.models import Author
+from django.db import transaction
+from django.utils import timezone
+from books.deletion import delete_rows
+from books.importer import chunked
+from books.models import Author, Book
 
 class Command(BaseCommand):
     help = 'Removes the author from the given ids'
 
 
-    def add_arguments(self, parser): 
+    def add_arguments(self, parser):
         # It defines the command-line arguments that the management command accepts.
         # Positional argument
-        parser.add_argument('author_ids', nargs='+', type=int)
+        parser.add_argument('author_ids', nargs='*', type=int)
 
-        # Optional argument
-        # parser.add_argument(
-        #     "--delete",
-        #     action="store_true",
-        #     help="Delete author instead of deactivating",
-        # )
+        # Optional arguments
+        parser.add_argument(
+            '--file',
+            help='Read more author ids from this file, one per line ("-" reads stdin)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of authors deleted per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only print how many authors and book links would be removed',
+        )
 
-    def handle(self, *args, **options): 
-        # processes the command-line arguments and performs the action of 
-        # removing authors based on the provided IDs.
-        for author_id in options['author_ids']:
+    def read_ids(self, options):
+        ids = list(options['author_ids'])
+        path = options['file']
+        if path:
+            stream = sys.stdin if path == '-' else open(path)
             try:
-                author = Author.objects.get(id=author_id)
-                author.delete()
-                self.stdout.write(self.style.SUCCESS(f'Successfully removed author with id {author_id}'))
-            except Author.DoesNotExist:
-                self.stdout.write(self.style.ERROR(f'Author with id {author_id} does not exist'))
-            '''
-            if options["delete"]:
-                author.delete()
-                # for optional argument --delete
-            '''
-            author.active = False
-            author.save()
-
-            self.stdout.write(self.style.SUCCESS(f'Successfully removed author with id {author_id}'))   
+                for line_number, line in enumerate(stream, start=1):
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    try:
+                        ids.append(int(line))
+                    except ValueError:
+                        raise CommandError(f'{path}:{line_number}: "{line}" is not an author id')
+            finally:
+                if stream is not sys.stdin:
+                    stream.close()
+        # Keep the given order but drop repeats
+        return list(dict.fromkeys(ids))
+
+    def handle(self, *args, **options):
+        # processes the command-line arguments and performs the action of
+        # removing authors based on the provided IDs.
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        author_ids = self.read_ids(options)
+        if not author_ids:
+            raise CommandError('Give at least one author id, or --file')
+
+        Through = Book.authors.through
+        found = set()
+        links = 0
+        for chunk in chunked(author_ids, options['chunk_size']):
+            with transaction.atomic():
+                existing = set(Author.objects.filter(id__in=chunk).values_list('id', flat=True))
+                found |= existing
+                if options['dry_run']:
+                    links += Through.objects.filter(author_id__in=existing).count()
+                    continue
+                # Their books change too (for ETag / Last-Modified)
+                Book.objects.filter(
+                    id__in=Through.objects.filter(author_id__in=existing).values('book_id')
+                ).update(updated_at=timezone.now())
+                # Clear the Book.authors rows ourselves in one statement per chunk
+                # instead of letting the delete collector load them.
+                links += Through.objects.filter(author_id__in=existing).delete()[0]
+                # Nothing else points at an author
+                delete_rows(Author, existing)
 
+        missing = set(author_ids) - found
+        for author_id in sorted(missing):
+            self.stdout.write(self.style.ERROR(f'Author with id {author_id} does not exist'))
 
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f'Dry run: would remove {len(found)} authors and {links} book links'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully removed {len(found)} authors and {links} book links'
+            ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from books.deletion import run_task, unfinished_tasks
+from books.models import DeletionTask
+
+
+class Command(BaseCommand):
+    help = 'Finishes publisher deletions that were interrupted or failed'
+
+    def handle(self, *args, **options):
+        failed = 0
+        tasks = list(unfinished_tasks())
+        for task in tasks:
+            try:
+                run_task(task)
+            except Exception as exc:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{task.publisher_name}: {exc}'))
+                continue
+            if task.status != DeletionTask.DONE:
+                self.stdout.write(f'{task.publisher_name}: taken over by another runner')
+                continue
+            self.stdout.write(f'{task.publisher_name}: {task.deleted_books} books deleted')
+
+        if failed:
+            raise CommandError(f'{failed} of {len(tasks)} deletions failed')
+        self.stdout.write(self.style.SUCCESS(f'Finished {len(tasks)} deletions'))
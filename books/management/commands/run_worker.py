@@ -0,0 +1,129 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from books import jobs
+from books.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (imports, author removal, publisher deletion)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.BOOKS_JOB_WORKERS,
+            help='Number of jobs run at the same time, each in its own process '
+                 '(default: BOOKS_JOB_WORKERS setting)'
+        )
+        parser.add_argument(
+            '--kind',
+            action='append',
+            choices=sorted(jobs.HANDLERS),
+            help='Only run jobs of this kind (can be repeated)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.BOOKS_JOB_POLL_INTERVAL,
+            help='Seconds between looks at an empty queue (default: BOOKS_JOB_POLL_INTERVAL setting)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of waiting for more jobs'
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Run the jobs one by one in this process (implies --once), for tests and debugging'
+        )
+        parser.add_argument(
+            '--requeue',
+            action='append',
+            default=[],
+            metavar='WORKER',
+            help='First put the jobs left running by this crashed worker (host:pid, as '
+                 'shown on the job pages) back in the queue (can be repeated)'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        self.name = jobs.worker_name()
+        for worker in options['requeue']:
+            count = jobs.requeue_running(worker)
+            self.stdout.write(f'Requeued {count} jobs of {worker}')
+
+        if options['sync']:
+            ran = self.run_inline(options['kind'])
+        else:
+            ran = self.run_pool(options)
+        self.stdout.write(self.style.SUCCESS(f'Worker {self.name} ran {ran} jobs'))
+
+    def report(self, job_id, status):
+        style = self.style.SUCCESS if status == Job.DONE else self.style.ERROR
+        self.stdout.write(style(f'Job #{job_id}: {status}'))
+
+    def run_inline(self, kinds):
+        ran = 0
+        while True:
+            job = jobs.claim_next(self.name, kinds)
+            if job is None:
+                return ran
+            self.report(job.id, jobs.execute(job.id))
+            ran += 1
+
+    def run_pool(self, options):
+        workers = options['workers']
+        # Fresh interpreters: nothing (like an open database connection) is
+        # shared with this process. django.setup() runs before the first job.
+        connections.close_all()
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+        running = {}
+        ran = 0
+        try:
+            while True:
+                while len(running) < workers:
+                    job = jobs.claim_next(self.name, options['kind'])
+                    if job is None:
+                        break
+                    self.stdout.write(f'Job #{job.id}: {job.kind} started')
+                    running[pool.submit(jobs.execute_in_process, job.id)] = job.id
+
+                if not running:
+                    if options['once']:
+                        return ran
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as exc:
+                        # The process itself died, execute() had no chance to record it
+                        status = Job.FAILED
+                        Job.objects.filter(id=job_id).update(
+                            status=Job.FAILED, error=repr(exc), finished_at=timezone.now()
+                        )
+                    self.report(job_id, status)
+                    ran += 1
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Interrupted, putting running jobs back in the queue'))
+            pool.shutdown(wait=True, cancel_futures=True)
+            jobs.requeue_running(self.name)
+            return ran
+        finally:
+            pool.shutdown(wait=True)
@@ -0,0 +1,75 @@
+from django.db import migrations, models
+
+
+def make_name_key(first_name, last_name):
+    # Same as Author.make_name_key(), historical models don't have model methods
+    last = " ".join(last_name.split()).casefold()
+    first = " ".join(first_name.split()).casefold()
+    return f"{last}|{first}"
+
+
+def backfill_keys(apps, schema_editor):
+    Author = apps.get_model("books", "Author")
+    Book = apps.get_model("books", "Book")
+    SyncedRecord = apps.get_model("books", "SyncedRecord")
+    Through = Book.authors.through
+
+    # Authors with the same normalized name are merged into the oldest one
+    # so the unique constraint can be added.
+    keep = {}
+    for author in Author.objects.order_by("id"):
+        key = make_name_key(author.first_name, author.last_name)
+        if key in keep:
+            linked = set(Through.objects.filter(author_id=keep[key]).values_list("book_id", flat=True))
+            for row in Through.objects.filter(author_id=author.id):
+                if row.book_id not in linked:
+                    Through.objects.create(book_id=row.book_id, author_id=keep[key])
+            author.delete()
+        else:
+            keep[key] = author.id
+            author.name_key = key
+            author.save(update_fields=["name_key"])
+
+    # Books the incremental sync already knows get their Gutenberg id. Other
+    # imported books can only be matched by title against Gutendex records:
+    # "add_books_from_api --match-titles" (BookImporter.match_titles).
+    assigned = set()
+    for synced in SyncedRecord.objects.order_by("gutenberg_id"):
+        if synced.book_id not in assigned:
+            Book.objects.filter(id=synced.book_id).update(gutenberg_id=synced.gutenberg_id)
+            assigned.add(synced.book_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0005_sync_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="gutenberg_id",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="author",
+            name="name_key",
+            field=models.CharField(editable=False, max_length=80, null=True),
+        ),
+        migrations.RunPython(backfill_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="book",
+            name="gutenberg_id",
+            field=models.PositiveIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="author",
+            name="name_key",
+            field=models.CharField(editable=False, max_length=80, unique=True),
+        ),
+        migrations.RemoveField(
+            model_name="syncedrecord",
+            name="book",
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+from books import search
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    search.create_table(schema_editor)
+    Book = apps.get_model("books", "Book")
+    Author = apps.get_model("books", "Author")
+    Publisher = apps.get_model("books", "Publisher")
+    for model in (Book, Author, Publisher):
+        rows = []
+        for obj in model.objects.all():
+            kind, name, extra = search.document(obj)
+            rows.append((search.rowid(kind, obj.pk), kind, name, extra))
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {search.TABLE} (rowid, kind, name, extra) VALUES (%s, %s, %s, %s)", rows
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        search.drop_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0006_external_keys"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 15:26
+
+import time
+
+from django.db import migrations, models
+
+
+def create_catalog_version(apps, schema_editor):
+    # The "catalog" version is the time of the last delete, the pages'
+    # validators read it together with the newest updated_at.
+    ReferenceVersion = apps.get_model('books', 'ReferenceVersion')
+    ReferenceVersion.objects.get_or_create(name='catalog', defaults={'version': time.time_ns()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_reference_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='classification',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='publisher',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(create_catalog_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def set_journal_mode(mode):
+    def run(apps, schema_editor):
+        # Kept in the database file, so once is enough (see mysite/sqlite/base.py)
+        connection = schema_editor.connection
+        if connection.vendor != "sqlite" or connection.is_in_memory_db():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA journal_mode = {mode}")
+    return run
+
+
+class Migration(migrations.Migration):
+    # The journal mode can't be changed inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("books", "0012_book_gutenberg_id_not_editable"),
+    ]
+
+    operations = [
+        migrations.RunPython(set_journal_mode("wal"), set_journal_mode("delete")),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models.functions import Greatest
+from django.contrib.auth.models import User
 import datetime
+import time
 from django.utils import timezone
 
 
@@ -7,6 +10,9 @@ class Classification(models.Model):
     code = models.CharField(max_length=3)
     name = models.CharField(max_length=100)
     description = models.TextField()
+    # Set on every save; Book's is also touched when its authors change.
+    # Used for the ETag / Last-Modified of the pages, see books/conditional.py
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.code} - {self.name}"
@@ -19,6 +25,7 @@ class Publisher(models.Model):
     state_province = models.CharField(max_length=50)
     country = models.CharField(max_length=50)
     website = models.URLField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -28,13 +35,32 @@ class Author(models.Model):
     first_name = models.CharField(max_length=30)
     last_name = models.CharField(max_length=40)
     email = models.EmailField("e-mail")
+    # Normalized "last|first" name, unique so imports can upsert authors without reading first
+    name_key = models.CharField(max_length=80, unique=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    @staticmethod
+    def make_name_key(first_name, last_name):
+        """Case and whitespace insensitive identity of an author name."""
+        last = " ".join(last_name.split()).casefold()
+        first = " ".join(first_name.split()).casefold()
+        return f"{last}|{first}"
+
+    def save(self, *args, **kwargs):
+        self.name_key = self.make_name_key(self.first_name, self.last_name)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"first_name", "last_name"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "name_key"}
+        super().save(*args, **kwargs)
+
 
 class Book(models.Model):
     title = models.CharField(max_length=100)
+    # Project Gutenberg id of imported books, None for books entered by hand
+    gutenberg_id = models.PositiveIntegerField(null=True, blank=True, unique=True, editable=False)
     authors = models.ManyToManyField(Author, related_name="books")
     publisher = models.ForeignKey(
         Publisher,
@@ -47,6 +73,14 @@ class Book(models.Model):
         related_name="books"
     )
     publication_date = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (title, id), see books/pagination.py
+            models.Index(fields=["title", "id"], name="book_title_id_idx"),
+            models.Index(fields=["classification", "title", "id"], name="book_class_title_id_idx"),
+        ]
 
     def __str__(self):
         return self.title
@@ -81,3 +115,131 @@ class Book(models.Model):
         return self.title
     
     '''
+
+
+class SyncState(models.Model):
+    """Progress of the incremental Gutendex sync for one search query ("" is the whole catalog)."""
+    query = models.CharField(max_length=200, unique=True)
+    watermark = models.PositiveIntegerField(default=0)  # Highest Gutenberg id fully synced
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.query or '(all)'} @ {self.watermark}"
+
+
+class SyncedRecord(models.Model):
+    """A Gutenberg record the sync has already seen, with a digest to detect changes."""
+    gutenberg_id = models.PositiveIntegerField(unique=True)
+    digest = models.CharField(max_length=40)
+
+    def __str__(self):
+        return f"{self.gutenberg_id} ({self.digest[:8]})"
+
+
+class DeletionTask(models.Model):
+    """A publisher being deleted in chunks by books.deletion, with its progress."""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    # Not a ForeignKey: the publisher is gone once the task is done
+    publisher_id = models.PositiveIntegerField(db_index=True)
+    publisher_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    total_books = models.PositiveIntegerField(default=0)
+    deleted_books = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Delete {self.publisher_name} ({self.status})"
+
+    @property
+    def percent(self):
+        if not self.total_books:
+            return 100 if self.status == self.DONE else 0
+        return min(100, self.deleted_books * 100 // self.total_books)
+
+
+class Job(models.Model):
+    """A unit of background work, queued here and run by the run_worker command."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=50)  # A handler name in books.jobs
+    args = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    message = models.CharField(max_length=200, blank=True)
+    output = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # Workers look for the oldest queued job of a kind
+        indexes = [models.Index(fields=["status", "kind", "id"], name="job_status_kind_id_idx")]
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} ({self.status})"
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @property
+    def percent(self):
+        if not self.total:
+            return None
+        return min(100, self.progress * 100 // self.total)
+
+
+class ReferenceVersion(models.Model):
+    """
+    One row per set of reference tables, bumped whenever one of them changes.
+    books.reference compares it with the version it loaded.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+    @classmethod
+    def current(cls, name):
+        return cls.objects.filter(name=name).values_list("version", flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        """
+        Moves the version on. Versions are the time of the change in
+        nanoseconds (or one more than the last, if that is later), so a
+        number is never reused even if the row is lost and created again.
+        """
+        now = time.time_ns()
+        updated = cls.objects.filter(name=name).update(
+            version=Greatest(models.F("version") + 1, models.Value(now))
+        )
+        if not updated:
+            cls.objects.get_or_create(name=name, defaults={"version": now})
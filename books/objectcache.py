@@ -0,0 +1,116 @@
+"""
+Primary key lookups of catalog objects, served from the cache.
+
+A cached object is stored as the plain tuple of its column values and
+rebuilt with Model.from_db(), the same way a queryset builds it, so an
+entry is small and the object behaves like one just loaded from the
+database. The key includes a digest of the column names, so entries of an
+older version of the model are never read back.
+
+Entries are dropped by the save/delete signals in books/signals.py. Misses
+go to the database: get_many() fetches all missing pks in one query. A
+miss in another connection while the save's transaction is open still
+reads and stores the old row, so the signals drop the entries again once
+it commits, and entries also expire after TIMEOUT. Misses are read from the primary database, not the
+replica (mysite/replica.py): every session shares the cache, so a stale
+row would outlive the replica refresh that fixes it.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404
+
+
+TIMEOUT = 5 * 60
+_schemas = {}
+
+
+def _schema(model):
+    """(column attnames, short digest of them) of a model."""
+    schema = _schemas.get(model)
+    if schema is None:
+        attnames = tuple(field.attname for field in model._meta.concrete_fields)
+        digest = hashlib.md5(",".join(attnames).encode(), usedforsecurity=False).hexdigest()[:8]
+        schema = _schemas[model] = (attnames, digest)
+    return schema
+
+
+def cache_key(model, pk):
+    return f"books:obj:{model._meta.label_lower}:{_schema(model)[1]}:{pk}"
+
+
+def _pack(obj):
+    return tuple(getattr(obj, attname) for attname in _schema(type(obj))[0])
+
+
+def _unpack(model, values):
+    return model.from_db(DEFAULT_DB_ALIAS, _schema(model)[0], values)
+
+
+def get_many(model, pks):
+    """Returns {pk: object} for the given pks that exist, with one query at most."""
+    pks = list(dict.fromkeys(pks))
+    keys = {cache_key(model, pk): pk for pk in pks}
+    found = {keys[key]: _unpack(model, values) for key, values in cache.get_many(keys).items()}
+    missing = [pk for pk in pks if pk not in found]
+    if missing:
+        loaded = model._default_manager.using(DEFAULT_DB_ALIAS).in_bulk(missing)
+        cache.set_many({cache_key(model, pk): _pack(obj) for pk, obj in loaded.items()}, TIMEOUT)
+        found.update(loaded)
+    return found
+
+
+async def aget_many(model, pks):
+    """get_many() for async views."""
+    pks = list(dict.fromkeys(pks))
+    keys = {cache_key(model, pk): pk for pk in pks}
+    found = {keys[key]: _unpack(model, values) for key, values in (await cache.aget_many(keys)).items()}
+    missing = [pk for pk in pks if pk not in found]
+    if missing:
+        loaded = await model._default_manager.using(DEFAULT_DB_ALIAS).ain_bulk(missing)
+        await cache.aset_many({cache_key(model, pk): _pack(obj) for pk, obj in loaded.items()}, TIMEOUT)
+        found.update(loaded)
+    return found
+
+
+def get(model, pk):
+    """Like model.objects.get(pk=pk), raises model.DoesNotExist."""
+    try:
+        pk = model._meta.pk.to_python(pk)
+    except ValidationError:
+        raise model.DoesNotExist(f"{model.__name__} with pk {pk!r} does not exist")
+    obj = get_many(model, [pk]).get(pk)
+    if obj is None:
+        raise model.DoesNotExist(f"{model.__name__} with pk {pk!r} does not exist")
+    return obj
+
+
+def get_object_or_404(model, pk):
+    try:
+        return get(model, pk)
+    except model.DoesNotExist:
+        raise Http404(f"No {model._meta.object_name} matches the given query.")
+
+
+async def aget_object_or_404(model, pk):
+    try:
+        pk = model._meta.pk.to_python(pk)
+    except ValidationError:
+        pk = None
+    obj = (await aget_many(model, [pk])).get(pk) if pk is not None else None
+    if obj is None:
+        raise Http404(f"No {model._meta.object_name} matches the given query.")
+    return obj
+
+
+def forget(model, pks):
+    cache.delete_many([cache_key(model, pk) for pk in pks])
+
+
+class CachedObjectMixin:
+    """For detail/update/delete class-based views: get_object() reads through the object cache."""
+
+    def get_object(self, queryset=None):
+        return get_object_or_404(self.model, self.kwargs.get(self.pk_url_kwarg))
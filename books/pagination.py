@@ -0,0 +1,206 @@
+import base64
+import json
+import math
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+
+DEFAULT_PAGE_SIZE = 50
+
+# SQLite integers are signed 64-bit
+MIN_INTEGER, MAX_INTEGER = -(2**63), 2**63 - 1
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    """Turns the ordering values of a row into an opaque url-safe token."""
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    """Reverse of encode_cursor(). Raises InvalidCursor for anything tampered with."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(token)
+    return values
+
+
+def cursor_values(model, fields, token):
+    """
+    Decodes a cursor for the ordering `fields` of `model`, with every value
+    checked and converted by its model field. Raises InvalidCursor.
+    """
+    values = decode_cursor(token, len(fields))
+    converted = []
+    for name, value in zip(fields, values):
+        if not isinstance(value, (str, int, float)):
+            raise InvalidCursor(token)  # null, a list or an object: never written by encode_cursor()
+        if isinstance(value, float) and not math.isfinite(value):
+            raise InvalidCursor(token)  # Infinity and NaN, which json.loads() accepts
+        field = model._meta.get_field(name)
+        try:
+            value = field.to_python(value)
+            field.run_validators(value)
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            raise InvalidCursor(token)
+        if isinstance(value, int) and not MIN_INTEGER <= value <= MAX_INTEGER:
+            raise InvalidCursor(token)  # SQLite can't bind it, whatever the field allows
+        converted.append(value)
+    return converted
+
+
+def _seek_filter(fields, values, reverse=False):
+    """
+    Builds the row-value comparison (f1, f2, ...) > (v1, v2, ...) as a Q object,
+    i.e. f1 > v1 OR (f1 = v1 AND f2 > v2) OR ...
+    """
+    lookup = "lt" if reverse else "gt"
+    condition = Q()
+    for i, field in enumerate(fields):
+        step = Q(**{f"{field}__{lookup}": values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            step &= Q(**{prev_field: prev_value})
+        condition |= step
+    return condition
+
+
+class KeysetPage:
+    """
+    One page of a keyset (cursor) paginated queryset.
+
+    Unlike django.core.paginator.Page there is no COUNT(*) and no OFFSET:
+    the page is found by seeking past the last row of the previous page
+    using the ordering columns, so every page costs the same no matter how
+    deep into the catalog it is. Rows are only fetched when the page is
+    first used.
+    """
+
+    def __init__(self, queryset, fields, per_page, after=None, before=None):
+        self.queryset = queryset
+        self.fields = fields
+        self.per_page = per_page
+        self.after = after
+        self.before = before
+
+    def _query(self):
+        fields = self.fields
+        queryset = self.queryset
+        if self.before is not None:
+            values = cursor_values(queryset.model, fields, self.before)
+            queryset = queryset.filter(_seek_filter(fields, values, reverse=True))
+            queryset = queryset.order_by(*[f"-{f}" for f in fields])
+        else:
+            if self.after is not None:
+                values = cursor_values(queryset.model, fields, self.after)
+                queryset = queryset.filter(_seek_filter(fields, values))
+            queryset = queryset.order_by(*fields)
+        # Fetch one extra row to know whether there is another page.
+        return queryset[:self.per_page + 1]
+
+    def _split(self, rows):
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if self.before is not None:
+            rows.reverse()
+            return rows, True, more
+        return rows, more, self.after is not None
+
+    @cached_property
+    def _rows(self):
+        return self._split(list(self._query()))
+
+    async def aload(self):
+        """Fetches the rows with the async ORM, so async views can render the page."""
+        if "_rows" not in self.__dict__:
+            self._rows = self._split([row async for row in self._query()])
+        return self
+
+    @property
+    def object_list(self):
+        return self._rows[0]
+
+    @property
+    def has_next(self):
+        return self._rows[1]
+
+    @property
+    def has_previous(self):
+        return self._rows[2] and bool(self.object_list)
+
+    def _cursor_for(self, obj):
+        return encode_cursor(getattr(obj, field) for field in self.fields)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor_for(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous:
+            return self._cursor_for(self.object_list[0])
+        return None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def paginate_keyset(request, queryset, fields=("title", "id"), per_page=None):
+    """
+    Returns a KeysetPage for the ?after= / ?before= cursor in the request.
+
+    `fields` must end with a unique column (normally "id") so the ordering
+    is total. Only those columns should be needed by the caller, so pass a
+    queryset restricted with .only() where possible.
+    """
+    if per_page is None:
+        per_page = getattr(settings, "BOOKS_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+    fields = tuple(fields)
+    after = request.GET.get("after") or None
+    before = request.GET.get("before") or None
+    page = KeysetPage(queryset, fields, per_page, after=after, before=before)
+    for token in (after, before):
+        if token is not None:
+            # Validate eagerly so a bad token is a 404, not a template error.
+            cursor_values(queryset.model, fields, token)
+    return page
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of very large tables.
+
+    COUNT(*) has to visit every row, so for an unfiltered queryset the count
+    is estimated from the highest primary key, which the index answers
+    straight away. It can be a little high after deletes, so the last pages
+    may come up short. Filtered querysets, and tables small enough that
+    counting is cheap, still get the exact COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, "query") and not queryset.query.where:
+            estimate = queryset.model._default_manager.aggregate(estimate=Max("pk"))["estimate"] or 0
+            if estimate > getattr(settings, "BOOKS_ADMIN_EXACT_COUNT_LIMIT", 10000):
+                return estimate
+        return super().count
@@ -0,0 +1,195 @@
+"""
+Classifications and publishers, held in memory by every process.
+
+Both tables are small and hardly ever change, so they are loaded once into
+read-only dicts (by id, by classification code and by publisher name) and
+looked up from there with no query. Don't modify the objects you get back,
+they are shared.
+
+Whenever either table changes, the signals in books/signals.py bump the
+"reference" row of ReferenceVersion. Before using its copy a process reads
+that row again: once per request when ReferenceDataMiddleware is
+installed (and only if the request uses reference data at all), or
+otherwise at most every BOOKS_REFERENCE_TTL seconds. When the version
+moved, the tables are loaded again. The tables are read from the same
+database as the version row, never from the replica, or an old copy could
+be kept under the new version.
+"""
+import threading
+import time
+from types import MappingProxyType
+
+from asgiref.local import Local
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from books.models import Classification, Publisher, ReferenceVersion
+
+
+NAME = "reference"
+
+
+class Snapshot:
+    """An immutable copy of the reference tables at one version."""
+
+    def __init__(self, version, classifications, publishers):
+        self.version = version
+        self.classifications = MappingProxyType({c.pk: c for c in classifications})
+        self.classifications_by_code = MappingProxyType({c.code: c for c in classifications})
+        self.publishers = MappingProxyType({p.pk: p for p in publishers})
+        self.publishers_by_name = MappingProxyType({p.name: p for p in publishers})
+
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+_request = Local()  # Per request under ASGI as well, where requests share a thread
+
+
+def current_version():
+    return ReferenceVersion.current(NAME)
+
+
+def bump():
+    """
+    Moves the version. The row is written in the caller's transaction, so
+    other processes see the new version together with the changed rows.
+    This process looks again now and once more after the commit, in case
+    another thread reloaded the old tables in between.
+    """
+    ReferenceVersion.bump(NAME)
+    _look_again()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(_look_again)
+
+
+def _look_again():
+    global _checked_at
+    _checked_at = 0.0
+    if hasattr(_request, "checked"):
+        _request.checked = False
+
+
+def _load(version):
+    return Snapshot(
+        version,
+        list(Classification.objects.using(DEFAULT_DB_ALIAS).order_by("id")),
+        list(Publisher.objects.using(DEFAULT_DB_ALIAS).order_by("id")),
+    )
+
+
+def snapshot(refresh=False):
+    """
+    The up-to-date Snapshot, checking the version row if it is time to.
+    refresh=True checks it now, for work that is not a request (an import).
+    """
+    global _snapshot, _checked_at
+    in_request = hasattr(_request, "checked")
+    if refresh:
+        due = True
+    elif in_request:
+        due = not _request.checked
+    else:
+        due = time.monotonic() - _checked_at >= getattr(settings, "BOOKS_REFERENCE_TTL", 60)
+    current = _snapshot
+    if current is not None and not due:
+        return current
+
+    version = current_version()
+    if current is None or current.version != version:
+        with _lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = _load(version)
+            current = _snapshot
+    _checked_at = time.monotonic()
+    if in_request:
+        _request.checked = True
+    return current
+
+
+def reset():
+    """Forgets the loaded tables, the next lookup loads them again."""
+    global _snapshot
+    with _lock:
+        _snapshot = None
+
+
+def begin_request():
+    _request.checked = False
+
+
+def end_request():
+    if hasattr(_request, "checked"):
+        del _request.checked
+
+
+# Lookups
+
+def classifications():
+    """All classifications in id order."""
+    return list(snapshot().classifications.values())
+
+
+def classification(pk):
+    """Raises Classification.DoesNotExist like a query would."""
+    try:
+        return snapshot().classifications[int(pk)]
+    except (KeyError, TypeError, ValueError):
+        raise Classification.DoesNotExist(f"No classification with id {pk!r}")
+
+
+def classification_by_code(code):
+    return snapshot().classifications_by_code.get(code)
+
+
+def publisher(pk):
+    try:
+        return snapshot().publishers[int(pk)]
+    except (KeyError, TypeError, ValueError):
+        raise Publisher.DoesNotExist(f"No publisher with id {pk!r}")
+
+
+def publisher_by_name(name):
+    return snapshot().publishers_by_name.get(name)
+
+
+def get_many(model, pks):
+    """The classifications or publishers with the given ids that exist, in the given order."""
+    current = snapshot()
+    table = current.classifications if model is Classification else current.publishers
+    found = []
+    for pk in pks:
+        try:
+            found.append(table[int(pk)])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return found
+
+
+class ReferenceDataMiddleware:
+    """Makes the first reference lookup of every request check the version row."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        begin_request()
+        try:
+            return self.get_response(request)
+        finally:
+            end_request()
+
+    async def __acall__(self, request):
+        begin_request()
+        try:
+            return await self.get_response(request)
+        finally:
+            end_request()
@@ -0,0 +1,183 @@
+"""
+Full-text search over the catalog with an SQLite FTS5 index.
+
+One virtual table, books_search, holds a document per book (title), author
+(full name) and publisher (name, plus city and country). The rowid packs
+the kind and primary key together (pk * 4 + kind code) so a document can be
+replaced or removed by rowid without scanning. Results are ranked with
+BM25, every search word is a prefix match and words are ANDed together.
+
+The index is kept up to date by the signals in books/signals.py and by the
+importer for its bulk inserts. rebuild_search_index recreates it from the
+tables. On databases without FTS5 is_available() is False and the views
+fall back to plain LIKE filters.
+"""
+import re
+
+from django.db import connection
+
+
+TABLE = "books_search"
+
+KIND_CODES = {"book": 1, "author": 2, "publisher": 3}
+KINDS = {code: kind for kind, code in KIND_CODES.items()}
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# The largest OFFSET SQLite takes
+MAX_OFFSET = 2**63 - 1
+
+
+def is_available():
+    return connection.vendor == "sqlite"
+
+
+def create_table(schema_editor):
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+        "kind, name, extra, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+
+
+def drop_table(schema_editor):
+    schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def rowid(kind, pk):
+    return pk * 4 + KIND_CODES[kind]
+
+
+def document(obj):
+    """Returns (kind, name, extra) for a Book, Author or Publisher."""
+    kind = obj._meta.model_name
+    if kind == "book":
+        return kind, obj.title, ""
+    if kind == "author":
+        return kind, f"{obj.first_name} {obj.last_name}", ""
+    if kind == "publisher":
+        return kind, obj.name, f"{obj.city} {obj.country}"
+    raise ValueError(f"{obj._meta.label} is not searchable")
+
+
+def index_objects(objects):
+    """Adds or replaces the documents of the given objects (all of one model or mixed)."""
+    rows = []
+    for obj in objects:
+        kind, name, extra = document(obj)
+        rows.append((rowid(kind, obj.pk), kind, name, extra))
+    if not rows or not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (rowid, kind, name, extra) VALUES (%s, %s, %s, %s)", rows
+        )
+
+
+def remove_objects(kind, pks):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(rowid(kind, pk),) for pk in pks])
+
+
+def rebuild():
+    """Recreates every document from the catalog tables, one INSERT ... SELECT per kind."""
+    from books.models import Author, Book, Publisher
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, kind, name, extra) "
+            f"SELECT id * 4 + {KIND_CODES['book']}, 'book', title, '' FROM {Book._meta.db_table}"
+        )
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, kind, name, extra) "
+            f"SELECT id * 4 + {KIND_CODES['author']}, 'author', first_name || ' ' || last_name, '' "
+            f"FROM {Author._meta.db_table}"
+        )
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, kind, name, extra) "
+            f"SELECT id * 4 + {KIND_CODES['publisher']}, 'publisher', name, city || ' ' || country "
+            f"FROM {Publisher._meta.db_table}"
+        )
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {TABLE}")
+        return cursor.fetchone()[0]
+
+
+def match_expression(query, kinds=None):
+    """
+    Turns free text into an FTS5 query: every word becomes a quoted prefix
+    term searched in the name and extra columns. Returns None if the text
+    has no words.
+    """
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    terms = " AND ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+    expression = f"{{name extra}} : ({terms})"
+    if kinds:
+        expression = "kind : ({}) AND {}".format(" OR ".join(kinds), expression)
+    return expression
+
+
+def search(query, kinds=None, limit=20, offset=0):
+    """
+    Returns [(kind, pk), ...] best match first. Fetch one more than you show
+    to know whether there is another page, there is no COUNT.
+    """
+    expression = match_expression(query, kinds)
+    if expression is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s "
+            f"ORDER BY bm25({TABLE}, 0.0, 10.0, 1.0) LIMIT %s OFFSET %s",
+            [expression, limit, offset],
+        )
+        return [(KINDS[row[0] % 4], row[0] // 4) for row in cursor.fetchall()]
+
+
+class SearchPage:
+    """One page of ranked search results, loaded with at most one query per model."""
+
+    def __init__(self, query, kinds=None, number=1, per_page=20):
+        from books import objectcache
+        from books.models import Author, Book, Publisher
+
+        self.query = query
+        # Past the results the page is empty anyway, but OFFSET has to fit SQLite's integers
+        self.number = min(max(1, number), MAX_OFFSET // per_page)
+        self.per_page = per_page
+        hits = search(query, kinds, limit=per_page + 1, offset=(self.number - 1) * per_page)
+        self.has_next = len(hits) > per_page
+        self.has_previous = self.number > 1
+        hits = hits[:per_page]
+
+        models = {"book": Book, "author": Author, "publisher": Publisher}
+        loaded = {}
+        for kind, model in models.items():
+            pks = [pk for hit_kind, pk in hits if hit_kind == kind]
+            if pks:
+                loaded[kind] = objectcache.get_many(model, pks)
+        # Keep the ranking order, skipping documents whose row is gone
+        self.hits = [
+            (kind, loaded[kind][pk]) for kind, pk in hits if pk in loaded.get(kind, {})
+        ]
+        self.object_list = [obj for _, obj in self.hits]
+
+    @property
+    def next_page_number(self):
+        return self.number + 1
+
+    @property
+    def previous_page_number(self):
+        return self.number - 1
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
@@ -0,0 +1,210 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from books import autocomplete, conditional, fragments, objectcache, reference, search
+from books.models import Author, Book, Classification, Publisher
+
+
+# Sent by code that writes with bulk_create()/bulk_update(), which send no
+# post_save. Arguments: sender (the model) and objects (the saved instances).
+bulk_saved = Signal()
+
+# Sent by code that deletes rows without the delete collector, which sends
+# no post_delete. Arguments: sender (the model) and pks (the deleted keys).
+bulk_deleted = Signal()
+
+# Fields that move a book from one classification or publisher page to another
+MOVE_FIELDS = {"publisher", "publisher_id", "classification", "classification_id"}
+
+
+def now_and_on_commit(func):
+    """
+    Runs func now, and again when the current transaction commits: until
+    then other connections still read the old rows, and a cache miss there
+    would store them again.
+    """
+    func()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(func)
+
+
+# Keep the full-text search index in step with the catalog tables
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+def index_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_objects([instance])
+
+
+@receiver(bulk_saved, sender=Book)
+@receiver(bulk_saved, sender=Author)
+@receiver(bulk_saved, sender=Publisher)
+def index_search_documents(sender, objects, **kwargs):
+    search.index_objects(objects)
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+def remove_search_document(sender, instance, **kwargs):
+    search.remove_objects(sender._meta.model_name, [instance.pk])
+
+
+@receiver(bulk_deleted, sender=Book)
+@receiver(bulk_deleted, sender=Author)
+@receiver(bulk_deleted, sender=Publisher)
+def remove_search_documents(sender, pks, **kwargs):
+    search.remove_objects(sender._meta.model_name, pks)
+
+
+# Keep this process's autocomplete indexes up to date
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+def update_autocomplete(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.update(sender._meta.model_name, [instance])
+
+
+@receiver(bulk_saved, sender=Author)
+@receiver(bulk_saved, sender=Publisher)
+def update_autocomplete_bulk(sender, objects, **kwargs):
+    autocomplete.update(sender._meta.model_name, objects)
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+def remove_autocomplete(sender, instance, **kwargs):
+    autocomplete.remove(sender._meta.model_name, [instance.pk])
+
+
+@receiver(bulk_deleted, sender=Author)
+@receiver(bulk_deleted, sender=Publisher)
+def remove_autocomplete_bulk(sender, pks, **kwargs):
+    autocomplete.remove(sender._meta.model_name, pks)
+
+
+# Any change to the catalog makes the cached page fragments stale
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Classification)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Classification)
+@receiver(bulk_saved, sender=Book)
+@receiver(bulk_saved, sender=Author)
+@receiver(bulk_saved, sender=Publisher)
+@receiver(bulk_deleted, sender=Book)
+@receiver(bulk_deleted, sender=Author)
+@receiver(bulk_deleted, sender=Publisher)
+def bump_catalog_version(sender, **kwargs):
+    now_and_on_commit(fragments.bump)
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def bump_catalog_version_for_authors(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        now_and_on_commit(fragments.bump)
+
+
+# Drop changed objects from the primary key cache
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Classification)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Classification)
+def forget_cached_object(sender, instance, **kwargs):
+    pk = instance.pk
+    now_and_on_commit(lambda: objectcache.forget(sender, [pk]))
+
+
+@receiver(bulk_saved, sender=Book)
+@receiver(bulk_saved, sender=Author)
+@receiver(bulk_saved, sender=Publisher)
+def forget_cached_objects(sender, objects, **kwargs):
+    pks = [obj.pk for obj in objects]
+    now_and_on_commit(lambda: objectcache.forget(sender, pks))
+
+
+@receiver(bulk_deleted, sender=Book)
+@receiver(bulk_deleted, sender=Author)
+@receiver(bulk_deleted, sender=Publisher)
+def forget_deleted_objects(sender, pks, **kwargs):
+    now_and_on_commit(lambda: objectcache.forget(sender, pks))
+
+
+# Tell every process to reload its in-memory classifications and publishers
+
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Classification)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Classification)
+@receiver(bulk_saved, sender=Publisher)
+@receiver(bulk_deleted, sender=Publisher)
+def bump_reference_version(sender, **kwargs):
+    reference.bump()
+
+
+# Keep the validators of the pages (books/conditional.py) moving: the books
+# and authors on both ends of changed links get a new updated_at, and
+# anything that takes a row out of a set without touching the rest of it
+# (deletes, a book moving to another classification or publisher) moves
+# the catalog version
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def touch_authorship(sender, instance, action, reverse, pk_set, **kwargs):
+    now = timezone.now()
+    other = Book if reverse else Author
+    if action == "pre_clear":
+        # The other ends are gone by post_clear
+        if reverse:
+            Book.objects.filter(authors=instance).update(updated_at=now)
+        else:
+            Author.objects.filter(books=instance).update(updated_at=now)
+        return
+    if action in ("post_add", "post_remove") and pk_set:
+        other.objects.filter(pk__in=pk_set).update(updated_at=now)
+    if action in ("post_add", "post_remove", "post_clear"):
+        type(instance).objects.filter(pk=instance.pk).update(updated_at=now)
+
+
+@receiver(pre_save, sender=Book)
+def notice_book_move(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & MOVE_FIELDS:
+        return
+    instance._catalog_moved = (
+        Book.objects.using(using)
+        .filter(pk=instance.pk)
+        .exclude(publisher_id=instance.publisher_id, classification_id=instance.classification_id)
+        .exists()
+    )
+
+
+@receiver(post_save, sender=Book)
+def record_book_move(sender, instance, **kwargs):
+    if instance.__dict__.pop("_catalog_moved", False):
+        conditional.bump_catalog()
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Classification)
+@receiver(bulk_deleted, sender=Book)
+@receiver(bulk_deleted, sender=Author)
+@receiver(bulk_deleted, sender=Publisher)
+def record_catalog_delete(sender, **kwargs):
+    conditional.bump_catalog()
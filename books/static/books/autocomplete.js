@@ -0,0 +1,32 @@
+// Type-ahead for inputs with a data-autocomplete="author|publisher" attribute.
+// Suggestions come from the JSON autocomplete view and fill a <datalist>.
+(function () {
+    var url = document.currentScript.dataset.url;
+
+    document.querySelectorAll("input[data-autocomplete]").forEach(function (input) {
+        var list = document.createElement("datalist");
+        list.id = input.id + "-suggestions";
+        input.setAttribute("list", list.id);
+        input.after(list);
+
+        var pending = null;
+        input.addEventListener("input", function () {
+            var query = input.value.trim();
+            if (pending) {
+                pending.abort();
+            }
+            pending = new AbortController();
+            var params = new URLSearchParams({kind: input.dataset.autocomplete, q: query});
+            fetch(url + "?" + params, {signal: pending.signal})
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    list.replaceChildren.apply(list, data.results.map(function (result) {
+                        var option = document.createElement("option");
+                        option.value = result.label;
+                        return option;
+                    }));
+                })
+                .catch(function () {});
+        });
+    });
+})();
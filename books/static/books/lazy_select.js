@@ -0,0 +1,56 @@
+// Lazy <select> pickers rendered by books/widgets.py. The page only contains
+// the selected options; this adds a filter box that loads matching options
+// from the widget's data-lookup-url, one page at a time.
+(function () {
+    document.querySelectorAll("select[data-lookup-url]").forEach(function (select) {
+        var filter = document.createElement("input");
+        filter.type = "search";
+        filter.placeholder = "Type to find more...";
+        var more = document.createElement("button");
+        more.type = "button";
+        more.textContent = "More";
+        more.hidden = true;
+        select.before(filter);
+        select.after(more);
+
+        var next = null;
+
+        function load(query, after) {
+            var params = new URLSearchParams({q: query});
+            if (after) {
+                params.set("after", after);
+            }
+            fetch(select.dataset.lookupUrl + "?" + params)
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    if (!after) {
+                        // Keep what is selected, replace the previous results
+                        Array.from(select.options).forEach(function (option) {
+                            if (!option.selected && option.value !== "") {
+                                option.remove();
+                            }
+                        });
+                    }
+                    data.results.forEach(function (result) {
+                        if (!select.querySelector('option[value="' + result.id + '"]')) {
+                            select.add(new Option(result.text, result.id));
+                        }
+                    });
+                    next = data.next;
+                    more.hidden = !next;
+                });
+        }
+
+        var timer = null;
+        filter.addEventListener("input", function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () { load(filter.value.trim(), null); }, 200);
+        });
+        more.addEventListener("click", function () { load(filter.value.trim(), next); });
+        select.addEventListener("focus", function () {
+            if (next === null && select.options.length <= 1) {
+                load("", null);
+            }
+        }, {once: true});
+    });
+})();
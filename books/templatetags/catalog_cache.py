@@ -0,0 +1,39 @@
+from django import template
+
+from books import fragments
+
+
+register = template.Library()
+
+
+class CatalogCacheNode(template.Node):
+    def __init__(self, nodelist, name, parts):
+        self.nodelist = nodelist
+        self.name = name
+        self.parts = parts
+
+    def render(self, context):
+        parts = [part.resolve(context) for part in self.parts]
+        key = fragments.fragment_key(self.name.resolve(context), *parts)
+        return fragments.get_or_build(key, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def catalogcache(parser, token):
+    """
+    Caches the enclosed template until the catalog changes:
+
+        {% catalogcache "book_list" request.GET.after request.GET.before %}
+            ...
+        {% endcatalogcache %}
+
+    The first argument names the fragment, the rest tell its variants apart
+    (which object, which page). The queries behind the enclosed template
+    only run when the fragment is rebuilt, so pass it lazy querysets.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' needs at least a fragment name")
+    nodelist = parser.parse(("endcatalogcache",))
+    parser.delete_first_token()
+    return CatalogCacheNode(nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]])
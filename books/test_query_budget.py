@@ -0,0 +1,200 @@
+"""
+Query budget regression tests.
+
+Every URL in books/urls.py and mysite/urls.py is requested against a
+catalog of 10, 100 and 1000 books (three authors each). A view fails if
+the number of queries it runs changes with the size of the catalog (an
+N+1 somewhere) or goes over its budget below. Query counts and wall times
+are written as JSON to QUERY_BUDGET_REPORT (default:
+query_budget_report.json in the project root) so releases can be diffed.
+"""
+import json
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from books import autocomplete, reference
+from books import urls as books_urls
+from books.importer import BookImporter
+from books.models import Author, Book, Classification, DeletionTask, Job, Publisher
+from mysite import urls as mysite_urls
+
+
+DATASET_SIZES = [10, 100, 1000]
+AUTHORS_PER_BOOK = 3
+
+# Most queries each view may run. About four of them are spent before and
+# after any view code: loading the session and the user, and saving the
+# session again because of SESSION_SAVE_EVERY_REQUEST.
+QUERY_BUDGETS = {
+    "login": 5,
+    "register": 5,
+    "logout": 4,
+    "book_list": 7,
+    "index": 7,
+    "detail": 9,
+    "book_create": 5,
+    "book_detail": 8,
+    "book_update": 9,
+    "book_delete": 6,
+    "author_detail": 9,
+    "classification_list": 7,
+    "classification_detail": 8,
+    "author_list": 6,
+    "search": 6,
+    "autocomplete": 7,
+    "lookup": 6,
+    "author_create": 5,
+    "publisher_list": 6,
+    "publisher_create": 5,
+    "publisher_update": 6,
+    "publisher_delete": 6,
+    "deletion_status": 6,
+    "job_list": 6,
+    "job_detail": 6,
+    "cache_stats": 5,
+    "home": 4,
+    "current_datetime": 4,
+    "hours_ahead": 4,
+    "math_two": 4,
+    "math_three": 4,
+    "valid_date": 4,
+    "admin:index": 6,
+    "admin:books_book_changelist": 9,
+    "admin:books_author_changelist": 8,
+    "admin:books_publisher_change": 10,
+}
+
+
+def report_path():
+    return os.environ.get(
+        "QUERY_BUDGET_REPORT", os.path.join(settings.BASE_DIR, "query_budget_report.json")
+    )
+
+
+class QueryBudgetTests(TestCase):
+    """Query counts of every view must not grow with the catalog"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(
+            username="staff", password="staffpass123", is_staff=True, is_superuser=True
+        )
+        cls.importer = BookImporter(batch_size=500)
+        cls.seeded = 0
+
+    def seed_to(self, size):
+        """Grows the catalog to `size` Gutenberg books"""
+        records = [
+            {
+                "id": number,
+                "title": f"Book {number:05d}",
+                "authors": [
+                    {"name": f"Author{(number * AUTHORS_PER_BOOK + i) % (size + 7)}, Jo"}
+                    for i in range(AUTHORS_PER_BOOK)
+                ],
+            }
+            for number in range(self.seeded + 1, size + 1)
+        ]
+        list(self.importer.import_records(records))
+        self.seeded = size
+
+    def cases(self):
+        """(name, url) for every view, pointing at rows that exist in the seeded catalog"""
+        book = Book.objects.order_by("id").first()
+        author = Author.objects.order_by("id").first()
+        classification = Classification.objects.order_by("id").first()
+        publisher = Publisher.objects.order_by("id").first()
+        task, _ = DeletionTask.objects.get_or_create(publisher_id=0, publisher_name="Gone")
+        job, _ = Job.objects.get_or_create(kind="remove_author", args={"author_ids": []}, created_by=self.staff)
+        return [
+            ("login", reverse("login")),
+            ("register", reverse("register")),
+            ("logout", reverse("logout")),
+            ("book_list", reverse("book_list")),
+            ("index", reverse("index")),
+            ("detail", reverse("detail", args=[book.id])),
+            ("book_create", reverse("book_create")),
+            ("book_detail", reverse("book_detail", args=[book.id])),
+            ("book_update", reverse("book_update", args=[book.id])),
+            ("book_delete", reverse("book_delete", args=[book.id])),
+            ("author_detail", reverse("author_detail", args=[author.id])),
+            ("classification_list", reverse("classification_list")),
+            ("classification_detail", reverse("classification_detail", args=[classification.id])),
+            ("author_list", reverse("author_list")),
+            ("search", reverse("search") + "?query=book+author"),
+            ("autocomplete", reverse("autocomplete") + "?kind=author&q=au"),
+            ("lookup", reverse("lookup", args=["author"]) + "?q=au"),
+            ("author_create", reverse("author_create")),
+            ("publisher_list", reverse("publisher_list")),
+            ("publisher_create", reverse("publisher_create")),
+            ("publisher_update", reverse("publisher_update", args=[publisher.id])),
+            ("publisher_delete", reverse("publisher_delete", args=[publisher.id])),
+            ("deletion_status", reverse("deletion_status", args=[task.id])),
+            ("job_list", reverse("job_list")),
+            ("job_detail", reverse("job_detail", args=[job.id])),
+            ("cache_stats", reverse("cache_stats")),
+            ("home", reverse("home")),
+            ("current_datetime", "/time/"),
+            ("hours_ahead", "/time/plus/3/"),
+            ("math_two", reverse("math_two", args=[6, 3])),
+            ("math_three", reverse("math_three", args=[6, 3, 2])),
+            ("valid_date", "/valid-date/2024/2/29/"),
+            ("admin:index", reverse("admin:index")),
+            ("admin:books_book_changelist", reverse("admin:books_book_changelist")),
+            ("admin:books_author_changelist", reverse("admin:books_author_changelist")),
+            ("admin:books_publisher_change", reverse("admin:books_publisher_change", args=[publisher.id])),
+        ]
+
+    def measure(self, url):
+        client = Client()
+        client.force_login(self.staff)
+        # Measure the cold path, not whatever an earlier request cached
+        cache.clear()
+        autocomplete.reset()
+        ContentType.objects.clear_cache()
+        # Reference tables are loaded once per process, not per request:
+        # measure with them loaded, which leaves only the version check
+        reference.reset()
+        reference.snapshot(refresh=True)
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - started
+        self.assertLess(response.status_code, 400, url)
+        return len(ctx), elapsed
+
+    def test_every_url_is_budgeted(self):
+        named = {pattern.name for pattern in books_urls.urlpatterns}
+        named |= {pattern.name for pattern in mysite_urls.urlpatterns if getattr(pattern, "name", None)}
+        named |= {"current_datetime", "hours_ahead", "valid_date", "admin:index"}
+        # Admin pages on top of the site's own urls are budgeted as well
+        self.assertEqual(named - set(QUERY_BUDGETS), set())
+        self.seed_to(1)
+        self.assertEqual({name for name, _ in self.cases()}, set(QUERY_BUDGETS))
+
+    def test_query_counts_do_not_grow_with_data(self):
+        report = {}
+        for size in DATASET_SIZES:
+            self.seed_to(size)
+            for name, url in self.cases():
+                queries, elapsed = self.measure(url)
+                entry = report.setdefault(name, {"url_name": name, "budget": QUERY_BUDGETS[name], "runs": {}})
+                entry["runs"][str(size)] = {"queries": queries, "ms": round(elapsed * 1000, 2)}
+
+        with open(report_path(), "w") as report_file:
+            json.dump({"sizes": DATASET_SIZES, "views": report}, report_file, indent=2, sort_keys=True)
+
+        for name, entry in report.items():
+            counts = [run["queries"] for run in entry["runs"].values()]
+            with self.subTest(view=name):
+                self.assertEqual(len(set(counts)), 1, f"{name} query count grows with data: {counts}")
+                self.assertLessEqual(max(counts), entry["budget"], f"{name} is over its query budget")
@@ -1,6 +1,15 @@
 # books/urls.py
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+
+def read_view(name, view):
+    # Under ASGI the read-only pages are async, see books/async_views.py
+    if getattr(settings, "BOOKS_ASYNC_VIEWS", False):
+        return getattr(async_views, name)
+    return view
+
 
 urlpatterns = [
     #Authentication 
@@ -9,20 +18,27 @@ urlpatterns = [
     path("logout/", views.logout_view, name="logout"),
 
     # App
-    path('', views.book_list, name='book_list'),
+    path('', read_view('book_list', views.book_list), name='book_list'),
     path('index/', views.index, name='index'),
     path('detail/<int:pk>/', views.detail, name='detail'),
     path('add/', views.BookCreateView.as_view(), name='book_create'),
-    path('<int:book_id>/', views.book_detail, name='book_detail'),
+    path('<int:book_id>/', read_view('book_detail', views.book_detail), name='book_detail'),
     path('<int:book_id>/edit/', views.BookUpdateView.as_view(), name='book_update'),
     path('<int:book_id>/delete/', views.BookDeleteView.as_view(), name='book_delete'),
-    path('authors/<int:author_id>/', views.author_detail, name='author_detail'),
-    path('classifications/', views.classification_list, name='classification_list'),
-    path('classifications/<int:classification_id>/', views.classification_detail, name='classification_detail'),
-    path('authors/', views.AuthorListView.as_view(), name='author_list'),
+    path('authors/<int:author_id>/', read_view('author_detail', views.author_detail), name='author_detail'),
+    path('classifications/', read_view('classification_list', views.classification_list), name='classification_list'),
+    path('classifications/<int:classification_id>/', read_view('classification_detail', views.classification_detail), name='classification_detail'),
+    path('search/', views.catalog_search, name='search'),
+    path('autocomplete/', views.autocomplete_view, name='autocomplete'),
+    path('lookup/<str:kind>/', views.lookup_view, name='lookup'),
+    path('authors/', read_view('author_list', views.AuthorListView.as_view()), name='author_list'),
     path('authors/add/', views.author_create, name='author_create'),
-    path('publishers/', views.PublisherListView.as_view(), name='publisher_list'),
+    path('publishers/', read_view('publisher_list', views.PublisherListView.as_view()), name='publisher_list'),
     path('publishers/add/', views.PublisherCreateView.as_view(), name='publisher_create'),
     path('publishers/<int:publisher_id>/edit/', views.PublisherUpdateView.as_view(), name='publisher_update'),
     path('publishers/<int:publisher_id>/delete/', views.PublisherDeleteView.as_view(), name='publisher_delete'),
+    path('deletions/<int:task_id>/', views.deletion_status, name='deletion_status'),
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/<int:job_id>/', views.job_detail, name='job_detail'),
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
 ]
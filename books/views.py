@@ -1,8 +1,15 @@
 from django.shortcuts import redirect, render, get_object_or_404
-from .models import Book, Author, Classification, Publisher
+from . import autocomplete, fragments, jobs, objectcache, reference, search
+from .conditional import conditional_page, newest
+from .deletion import start_publisher_deletion
+from .objectcache import CachedObjectMixin
+from .models import Book, Author, Classification, Publisher, DeletionTask, Job
+from .pagination import InvalidCursor, paginate_keyset
 from .forms import (
     AuthorSearchForm, 
     PublisherSearchForm, 
+    CatalogSearchForm,
+    ImportJobForm,
     BookForm, 
     PublisherForm, 
     AuthorForm,
@@ -13,9 +20,13 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User 
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import Http404
+from django.db.models import Count, Prefetch, Q, prefetch_related_objects
+from django.http import Http404, JsonResponse
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
+from django.conf import settings
+from django.core.cache import cache
+import os
 
 
 #Users and Authentication views
@@ -59,50 +70,157 @@ def logout_view(request):
     return redirect("login")   
 
 
+def paginate_books(request, queryset):
+    # Cursor pagination over (title, id); templates only need id and title.
+    try:
+        return paginate_keyset(request, queryset.only("id", "title"))
+    except InvalidCursor:
+        raise Http404("Invalid page cursor")
+
+
+# Validators of the pages below (books/conditional.py): the newest
+# updated_at of every set of rows a page shows
+
+def all_books_state(request, **kwargs):
+    return {"books": newest(Book.objects.all())}
+
+
+def book_state(request, book_id=None, pk=None):
+    book_id = book_id or pk
+    return {
+        "book": newest(Book.objects.filter(id=book_id)),
+        "authors": newest(Author.objects.filter(books=book_id)),
+        "publisher": newest(Publisher.objects.filter(books=book_id)),
+    }
+
+
+def author_state(request, author_id):
+    return {
+        "author": newest(Author.objects.filter(id=author_id)),
+        "books": newest(Book.objects.filter(authors=author_id)),
+        "coauthors": newest(Author.objects.filter(books__authors=author_id)),
+    }
+
+
+def classifications_state(request):
+    return {"classifications": newest(Classification.objects.all())}
+
+
+def classification_state(request, classification_id):
+    return {
+        "classification": newest(Classification.objects.filter(id=classification_id)),
+        "books": newest(Book.objects.filter(classification_id=classification_id)),
+    }
+
+
 # 1. List all books
 @login_required # will this be rendered to book_list? Yes, it will restrict access to the book_list view to authenticated users only.
+@conditional_page(all_books_state)
 def book_list(request):
-    books = Book.objects.all()  # Get all books from database
-    return render(request, 'books/book_list.html', {'books': books})
+    books = paginate_books(request, Book.objects.all())  # One page of books from database
+    return render(request, 'books/book_list.html', {'books': books, 'page': books})
+
+
+def author_names():
+    # Only the columns needed to print and link an author
+    return Author.objects.only("id", "first_name", "last_name").order_by("last_name", "first_name", "id")
 
 
 # 2. Show details of a single book
 @login_required
+@conditional_page(book_state)
 def book_detail(request, book_id):
-    book = get_object_or_404(Book, id=book_id)  # Get book or show 404 error
+    book = objectcache.get_object_or_404(Book, book_id)  # Get book (from the cache if we can) or show 404 error
+    prefetch_related_objects([book], Prefetch("authors", queryset=author_names()))  # Its authors in one query
     return render(request, 'books/book_detail.html', {'book': book})
 
+def search_page(request, query, kinds=None):
+    # One page of ranked full-text results, ?page=N picks the page
+    try:
+        number = int(request.GET.get("page", 1))
+    except ValueError:
+        number = 1
+    per_page = getattr(settings, "BOOKS_SEARCH_PAGE_SIZE", 20)
+    return search.SearchPage(query, kinds, number=number, per_page=per_page)
+
+
+def author_search(request):
+    # (authors matching ?query=, the search page or None), shared with books/async_views.py
+    queryset = Author.objects.all()
+    form = AuthorSearchForm(request.GET)
+    if form.is_valid():
+        query = form.cleaned_data.get("query")
+        if query and search.is_available():
+            # Ranked prefix search on the FTS5 index
+            page = search_page(request, query, kinds=["author"])
+            return page.object_list, page
+        if query:
+            words = query.split()
+            for word in words:
+                queryset = queryset.filter(
+                    first_name__icontains=word
+                ) | queryset.filter(last_name__icontains=word)
+    return queryset.distinct(), None
+
+
+def publisher_search(request):
+    queryset = Publisher.objects.all()
+    form = PublisherSearchForm(request.GET)
+    if form.is_valid():
+        query = form.cleaned_data.get("query")
+        if query and search.is_available():
+            # Matches publisher name, city and country
+            page = search_page(request, query, kinds=["publisher"])
+            return page.object_list, page
+        if query:
+            words = query.split()
+            for word in words:
+                queryset = queryset.filter(name__icontains=word)
+    return queryset.distinct(), None
+
+
 # 3.List all authors with search functionality
 class AuthorListView(LoginRequiredMixin, ListView): 
     model = Author
     template_name = 'books/author_list.html'
     context_object_name = 'authors'
+    search_page = None
 
     def get_queryset(self): #  Override get_queryset to add search functionality
-        queryset = Author.objects.all()
-        form = AuthorSearchForm(self.request.GET)
-        if form.is_valid():
-            query = form.cleaned_data.get("query")
-            if query:
-                words = query.split()
-                for word in words:
-                    queryset = queryset.filter(
-                        first_name__icontains=word
-                    ) | queryset.filter(last_name__icontains=word)
-        return queryset.distinct()
+        authors, self.search_page = author_search(self.request)
+        return authors
 
     def get_context_data(self, **kwargs): # Add search form to context  
         context = super().get_context_data(**kwargs)
         context['form'] = AuthorSearchForm(self.request.GET)
+        context['search_page'] = self.search_page
         return context
 
 
 # 4. Show author details and their books
 @login_required
+@conditional_page(author_state)
 def author_detail(request, author_id):
-    author = get_object_or_404(Author, id=author_id)  # Get author
-    books = author.books.all()  # Get all books by this author (using related_name)
-    return render(request, 'books/author_detail.html', {'author': author, 'books': books})
+    author = objectcache.get_object_or_404(Author, author_id)  # Get author
+    return render(request, 'books/author_detail.html', {'author': author, 'books': author_books(author)})
+
+
+def author_books(author):
+    # All books by this author with their author count and co-authors, in two
+    # queries however many books there are. The count is annotated on a
+    # fresh join, filtering through author.books would make it count only 1.
+    book_ids = Book.authors.through.objects.filter(author_id=author.id).values("book_id")
+    return (
+        Book.objects.filter(id__in=book_ids)
+        .only("id", "title")
+        .annotate(author_count=Count("authors"))
+        .prefetch_related(Prefetch(
+            "authors",
+            queryset=author_names().exclude(id=author.id),
+            to_attr="coauthors",
+        ))
+        .order_by("title", "id")
+    )
 
 
 # 5. List all publishers with search functionality
@@ -110,38 +228,101 @@ class PublisherListView(LoginRequiredMixin, ListView):
     model = Publisher
     template_name = 'books/publisher_list.html'
     context_object_name = 'publishers'
+    search_page = None
 
     def get_queryset(self):
-        queryset = Publisher.objects.all()
-        form = PublisherSearchForm(self.request.GET)
-        if form.is_valid():
-            query = form.cleaned_data.get("query")
-            if query:
-                words = query.split()
-                for word in words:
-                    queryset = queryset.filter(name__icontains=word)
-        return queryset.distinct()
+        publishers, self.search_page = publisher_search(self.request)
+        return publishers
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['form'] = PublisherSearchForm(self.request.GET)
+        context['search_page'] = self.search_page
         return context
 
 
+# Type-ahead suggestions for the author and publisher search boxes
+@login_required
+def autocomplete_view(request):
+    kind = request.GET.get("kind", "author")
+    if kind not in ("author", "publisher"):
+        return JsonResponse({"error": "kind must be author or publisher"}, status=400)
+    prefix = request.GET.get("q", "").strip()
+    results = []
+    if len(prefix) >= getattr(settings, "BOOKS_AUTOCOMPLETE_MIN_PREFIX", 2):
+        limit = getattr(settings, "BOOKS_AUTOCOMPLETE_LIMIT", 10)
+        results = [
+            {"id": pk, "label": label}
+            for pk, label in autocomplete.lookup(kind, prefix, limit)
+        ]
+    return JsonResponse({"kind": kind, "results": results})
+
+
+# Paginated options for the lazy pickers of BookForm (books/widgets.py)
+LOOKUPS = {
+    # kind: (queryset, keyset ordering, fields matched by ?q=)
+    "author": (Author.objects.only("id", "first_name", "last_name"), ("last_name", "first_name", "id"), ("first_name", "last_name")),
+    "publisher": (Publisher.objects.only("id", "name"), ("name", "id"), ("name",)),
+    "classification": (Classification.objects.only("id", "code", "name"), ("code", "id"), ("code", "name")),
+}
+
+
+@login_required
+def lookup_view(request, kind):
+    if kind not in LOOKUPS:
+        raise Http404("Unknown lookup")
+    queryset, ordering, match_fields = LOOKUPS[kind]
+    query = request.GET.get("q", "").strip()
+    if query:
+        condition = Q()
+        for field in match_fields:
+            condition |= Q(**{f"{field}__istartswith": query})
+        queryset = queryset.filter(condition)
+    try:
+        page = paginate_keyset(
+            request, queryset, ordering, per_page=getattr(settings, "BOOKS_LOOKUP_PAGE_SIZE", 20)
+        )
+        results = [{"id": obj.pk, "text": str(obj)} for obj in page]
+    except InvalidCursor:
+        raise Http404("Invalid page cursor")
+    return JsonResponse({"results": results, "next": page.next_cursor})
+
+
+# Search books, authors and publishers at once
+@login_required
+def catalog_search(request):
+    form = CatalogSearchForm(request.GET)
+    page = None
+    if form.is_valid() and form.cleaned_data["query"] and search.is_available():
+        page = search_page(request, form.cleaned_data["query"])
+    return render(request, 'books/search.html', {'form': form, 'page': page})
+
+
 
 # 6. List all classifications
 @login_required 
+@conditional_page(classifications_state)
 def classification_list(request):
-    classifications = Classification.objects.all()  # Get all classifications
+    classifications = reference.classifications()  # All classifications, from memory
     return render(request, 'books/classification_list.html', {'classifications': classifications})
 
 
 # 7. Show all books in a classification
 @login_required
+@conditional_page(classification_state)
 def classification_detail(request, classification_id):
-    classification = get_object_or_404(Classification, id=classification_id)  # Get classification
-    books = classification.books.all()  # Get all books in this classification
-    return render(request, 'books/classification_detail.html', {'classification': classification, 'books': books})
+    try:
+        classification = reference.classification(classification_id)  # Get classification, from memory
+    except Classification.DoesNotExist:
+        raise Http404("No Classification matches the given query.")
+    # Not classification.books: the related manager would set book.classification
+    # on every row and load the deferred classification_id one query at a time.
+    books = paginate_books(request, Book.objects.filter(classification_id=classification.id))  # One page of books in this classification
+    return render(request, 'books/classification_detail.html', {
+        'classification': classification,
+        'books': books,
+        'page': books,
+    })
 
 
 
@@ -155,7 +336,7 @@ class BookCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     def test_func(self):
         return is_admin(self.request.user)
 
-class BookUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class BookUpdateView(LoginRequiredMixin, UserPassesTestMixin, CachedObjectMixin, UpdateView):
     model = Book
     form_class = BookForm
     template_name = 'books/book_form.html'
@@ -167,7 +348,7 @@ class BookUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def get_success_url(self):
         return reverse_lazy('book_detail', kwargs={'book_id': self.object.pk})
 
-class BookDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class BookDeleteView(LoginRequiredMixin, UserPassesTestMixin, CachedObjectMixin, DeleteView):
     model = Book
     template_name = 'books/book_confirm_delete.html'
     success_url = reverse_lazy('book_list')
@@ -188,7 +369,7 @@ class PublisherCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     def test_func(self):
         return is_admin(self.request.user)
 
-class PublisherUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class PublisherUpdateView(LoginRequiredMixin, UserPassesTestMixin, CachedObjectMixin, UpdateView):
     model = Publisher
     form_class = PublisherForm
     template_name = 'books/publisher_form.html'
@@ -198,7 +379,7 @@ class PublisherUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def test_func(self):
         return is_admin(self.request.user)
 
-class PublisherDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class PublisherDeleteView(LoginRequiredMixin, UserPassesTestMixin, CachedObjectMixin, DeleteView):
     model = Publisher
     template_name = 'books/publisher_confirm_delete.html'
     success_url = reverse_lazy('publisher_list')
@@ -208,6 +389,64 @@ class PublisherDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return is_admin(self.request.user)
 
+    def form_valid(self, form):
+        # A cascade over a big catalog is done in chunks, maybe in the background
+        task = start_publisher_deletion(self.object)
+        if task.status == DeletionTask.DONE:
+            return redirect(self.get_success_url())
+        return redirect('deletion_status', task_id=task.id)
+
+
+@user_passes_test(is_admin)
+def deletion_status(request, task_id):
+    task = get_object_or_404(DeletionTask, id=task_id)
+    return render(request, 'books/deletion_status.html', {'task': task})
+
+
+#Background jobs
+@user_passes_test(is_admin)
+def job_list(request):
+    if request.method == "POST":
+        form = ImportJobForm(request.POST)
+        if form.is_valid():
+            job = jobs.enqueue("add_books_from_api", form.job_args(), user=request.user)
+            return redirect('job_detail', job_id=job.id)
+    else:
+        form = ImportJobForm()
+    recent = Job.objects.defer("output", "error").select_related("created_by").order_by("-id")
+    status = request.GET.get("status")
+    if status:
+        recent = recent.filter(status=status)
+    return render(request, 'books/job_list.html', {
+        'jobs': recent[:50],
+        'form': form,
+        'statuses': Job.STATUS_CHOICES,
+        'status': status,
+    })
+
+
+@user_passes_test(is_admin)
+def job_detail(request, job_id):
+    job = get_object_or_404(Job.objects.select_related("created_by"), id=job_id)
+    return render(request, 'books/job_detail.html', {'job': job})
+
+
+# Hit/miss counters of the catalog fragment cache (books/fragments.py)
+@user_passes_test(is_admin)
+def cache_stats(request):
+    if request.method == "POST":
+        fragments.reset_stats()
+        if hasattr(cache, "reset_stats"):
+            cache.reset_stats()
+        return redirect('cache_stats')
+    return render(request, 'books/cache_stats.html', {
+        'stats': fragments.stats(),
+        'version': fragments.version(),
+        # L1/L2 counters when the two-tier backend (mysite/cache.py) is in use
+        'tiers': cache.stats() if hasattr(cache, "stats") else None,
+        'pid': os.getpid(),
+    })
+
 
 #Author CRUD
 @user_passes_test(is_admin)  # Only admin users can create authors
@@ -224,15 +463,19 @@ def author_create(request):
 
 
 #unit tests views for index and detail
+@conditional_page(all_books_state)
 def index(request):
-    books = Book.objects.all()
-    return render(request, "books/books.html", {"books": books})
+    books = paginate_books(request, Book.objects.all())
+    return render(request, "books/books.html", {"books": books, "page": books})
 
 
+@conditional_page(book_state)
 def detail(request, pk):
+    book = objectcache.get_object_or_404(Book, pk)
     try:
-        book = Book.objects.get(pk=pk)
-    except Book.DoesNotExist:
+        book.publisher = reference.publisher(book.publisher_id)
+    except Publisher.DoesNotExist:
         raise Http404()
+    prefetch_related_objects([book], Prefetch("authors", queryset=author_names()))
 
     return render(request, "books/book.html", {"book": book})
\ No newline at end of file
@@ -0,0 +1,60 @@
+from django import forms
+from django.urls import reverse
+
+from books import reference
+from books.models import Classification, Publisher
+
+
+# Small tables kept in memory by books.reference
+REFERENCE_MODELS = (Classification, Publisher)
+
+
+class LazyChoiceMixin:
+    """
+    For ModelChoiceField / ModelMultipleChoiceField widgets: renders only the
+    options that are currently selected instead of a row per object in the
+    queryset. The rest are fetched page by page from the lookup view by
+    books/lazy_select.js, using the url in the data-lookup-url attribute.
+    """
+
+    def __init__(self, lookup_kind, attrs=None):
+        super().__init__(attrs)
+        self.lookup_kind = lookup_kind
+
+    class Media:
+        js = ["books/lazy_select.js"]
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context["widget"]["attrs"]["data-lookup-url"] = reverse("lookup", args=[self.lookup_kind])
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        selected = [v for v in value if v not in ("", None)]
+        options = []
+        if not self.allow_multiple_selected and field.empty_label is not None:
+            options.append(self.create_option(name, "", field.empty_label, not selected, 0, attrs=attrs))
+        if selected and field.queryset.model in REFERENCE_MODELS:
+            objects = reference.get_many(field.queryset.model, selected)  # No query
+        elif selected:
+            try:
+                objects = list(field.queryset.filter(pk__in=selected))
+            except (ValueError, TypeError):
+                objects = []  # Garbage was posted, the field reports it
+        else:
+            objects = []
+        for obj in objects:
+            option_value = field.prepare_value(obj)
+            options.append(self.create_option(
+                name, option_value, field.label_from_instance(obj), True, len(options), attrs=attrs
+            ))
+        return [(None, options, 0)]
+
+
+class LazySelect(LazyChoiceMixin, forms.Select):
+    pass
+
+
+class LazySelectMultiple(LazyChoiceMixin, forms.SelectMultiple):
+    pass
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+# Async views for the read-only catalog pages (books/async_views.py)
+os.environ.setdefault('BOOKS_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,290 @@
+"""
+Two-tier cache backend: a small LRU inside each process (L1) in front of a
+cache every process shares (L2, on disk by default).
+
+Reads are answered from L1 when possible, so the common case costs no I/O.
+Every write goes to L2, bumps a generation number stored there and logs
+which keys that generation changed. Each process reads the number again
+at most every GENERATION_CHECK_INTERVAL seconds and drops the logged keys
+from its L1, so a write made by one worker is seen by the others within
+that interval and the rest of their L1 stays warm. A process that fell
+too far behind, or finds part of the log gone, empties its L1 instead.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "mysite.cache.TwoTierCache",
+            "LOCATION": "/var/tmp/mysite-cache",  # Location of the L2 cache
+            "OPTIONS": {
+                "L2_BACKEND": "mysite.cache.LockedFileBasedCache",
+                "L1_MAX_ENTRIES": 1000,           # Per process
+                "L1_TIMEOUT": 60,                 # Most seconds a value lives in L1
+                "GENERATION_CHECK_INTERVAL": 1,
+            },
+        },
+    }
+
+Other OPTIONS (MAX_ENTRIES, CULL_FREQUENCY, ...) are passed on to L2.
+Operations that need to be atomic across processes (add, incr, and the
+generation bump) are only as atomic as the L2 backend makes them. Django's
+FileBasedCache checks and then writes, so two processes can both add the
+same key (and both take a lock made with add) or both increment from the
+same number (and lose a generation's log). LockedFileBasedCache, the
+default L2, runs add and incr under a file lock instead.
+
+L2 is given the same keys and versions as this cache, so L2 entries are
+the ones a plain L2 backend with the same KEY_PREFIX would use.
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+from django.utils.module_loading import import_string
+
+
+GENERATION_KEY = "twotier:generation"
+CHANGED_KEY = "twotier:changed:%d"
+
+# Generations a process catches up on key by key, more and it empties its L1
+MAX_LOG_GAP = 100
+# Seconds a generation's log is kept, well over any GENERATION_CHECK_INTERVAL
+LOG_TIMEOUT = 300
+
+_MISSING = object()
+
+
+class LockedFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache whose add() and incr() (and so decr()) are atomic across
+    processes: they run under an exclusive lock on one file in the cache
+    directory. Other operations don't take the lock, a set() already
+    replaces the file in one rename.
+    """
+
+    lock_filename = "cache.lock"  # Not a .djcache file, so clear() and culling leave it
+
+    @contextmanager
+    def _exclusive(self):
+        self._createdir()
+        with open(os.path.join(self._dir, self.lock_filename), "ab") as f:
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(f)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._exclusive():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._exclusive():
+            return super().incr(key, delta, version)
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        params = dict(params)
+        options = dict(params.get("OPTIONS", {}))
+        l2_backend = options.pop("L2_BACKEND", "mysite.cache.LockedFileBasedCache")
+        self.l1_max_entries = int(options.pop("L1_MAX_ENTRIES", 1000))
+        self.l1_timeout = float(options.pop("L1_TIMEOUT", 60))
+        self.check_interval = float(options.pop("GENERATION_CHECK_INTERVAL", 1))
+        params["OPTIONS"] = options
+        super().__init__(params)
+        self.l2 = import_string(l2_backend)(location, params)
+
+        self._l1 = OrderedDict()  # key -> (expires_at, pickled value)
+        self._lock = threading.Lock()
+        self._generation = None
+        self._checked_at = 0.0
+        self._stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "invalidations": 0}
+
+    # L1
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, pickled = entry
+            if expires_at <= time.monotonic():
+                del self._l1[key]
+                return _MISSING
+            self._l1.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def _l1_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        timeout = self.get_backend_timeout(timeout)
+        lifetime = self.l1_timeout if timeout is None else min(timeout - time.time(), self.l1_timeout)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if lifetime <= 0:
+                self._l1.pop(key, None)
+                return
+            self._l1[key] = (time.monotonic() + lifetime, pickled)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, key):
+        with self._lock:
+            self._l1.pop(key, None)
+
+    def _l1_clear(self):
+        with self._lock:
+            self._l1.clear()
+            self._stats["invalidations"] += 1
+
+    def _l1_forget(self, keys):
+        with self._lock:
+            for key in keys:
+                if self._l1.pop(key, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    # Generations
+
+    def _current_generation(self):
+        generation = self.l2.get(GENERATION_KEY)
+        if generation is None:
+            # Start from the clock so a lost generation never repeats an old one
+            self.l2.add(GENERATION_KEY, time.time_ns() // 1000, None)
+            generation = self.l2.get(GENERATION_KEY)
+        return generation
+
+    def _catch_up(self, generation):
+        """Drops from L1 what the generations after ours, up to this one, changed."""
+        if self._generation is None or generation == self._generation:
+            pass
+        elif not 0 < generation - self._generation <= MAX_LOG_GAP:
+            self._l1_clear()
+        else:
+            log_keys = [CHANGED_KEY % n for n in range(self._generation + 1, generation + 1)]
+            logs = self.l2.get_many(log_keys)
+            if len(logs) < len(log_keys):
+                self._l1_clear()  # Lost, or not written yet
+            else:
+                self._l1_forget(key for keys in logs.values() for key in keys)
+        self._generation = generation
+        self._checked_at = time.monotonic()
+
+    def _check_generation(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._catch_up(self._current_generation())
+
+    def _bump_generation(self, keys):
+        """Starts a generation for a write of these (made) keys."""
+        try:
+            generation = self.l2.incr(GENERATION_KEY)
+        except ValueError:
+            self._current_generation()
+            generation = self.l2.incr(GENERATION_KEY)
+        self.l2.set(CHANGED_KEY % generation, list(keys), LOG_TIMEOUT)
+        # What others wrote since we last looked, not our own write
+        self._catch_up(generation - 1)
+        self._generation = generation
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        self._check_generation()
+        value = self._l1_get(made)
+        if value is not _MISSING:
+            self._count("l1_hits")
+            return value
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._count("misses")
+            return default
+        self._count("l2_hits")
+        self._l1_set(made, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, timeout, version=version)
+        self._bump_generation([made])
+        self._l1_set(made, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self._bump_generation([made])
+            self._l1_set(made, value, timeout)
+        else:
+            self._l1_delete(made)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        self._l1_delete(made)  # Reloaded from L2 with the new expiry
+        return self.l2.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        self._l1_delete(made)
+        deleted = self.l2.delete(key, version=version)
+        self._bump_generation([made])
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        self._l1_delete(made)
+        value = self.l2.incr(key, delta, version=version)
+        self._bump_generation([made])
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        made = {key: self.make_and_validate_key(key, version=version) for key in data}
+        failed = self.l2.set_many(data, timeout, version=version)
+        # One generation for the lot
+        self._bump_generation(made.values())
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(made[key], value, timeout)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        made = {key: self.make_and_validate_key(key, version=version) for key in keys}
+        for key in made.values():
+            self._l1_delete(key)
+        self.l2.delete_many(list(made), version=version)
+        self._bump_generation(made.values())
+
+    def clear(self):
+        self.l2.clear()
+        self._l1_clear()
+        self._generation = self._current_generation()
+        self._checked_at = time.monotonic()
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
+
+    def stats(self):
+        """This process's counters, with the share of reads answered by each tier."""
+        with self._lock:
+            stats = dict(self._stats, l1_entries=len(self._l1), l1_max_entries=self.l1_max_entries)
+        reads = stats["l1_hits"] + stats["l2_hits"] + stats["misses"]
+        stats["reads"] = reads
+        stats["l1_hit_rate"] = stats["l1_hits"] / reads if reads else None
+        stats["l2_hit_rate"] = stats["l2_hits"] / reads if reads else None
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            for name in ("l1_hits", "l2_hits", "misses", "invalidations"):
+                self._stats[name] = 0
@@ -0,0 +1,197 @@
+"""
+Per-request timings: number of SQL queries and time spent in them, time
+spent rendering templates and total time in the view.
+
+    MIDDLEWARE = ["mysite.instrumentation.TimingMiddleware", ...]  # First, to time everything below
+    TEMPLATES = [{"BACKEND": "mysite.instrumentation.TimedTemplates", ...}]
+    INSTRUMENTATION_ENABLED = True
+    INSTRUMENTATION_SLOW_QUERY_MS = 100
+
+Every response gets a Server-Timing header, which browsers show in their
+network panel:
+
+    Server-Timing: db;dur=3.2;desc="5 queries", tpl;dur=8.1, view;dur=14.0
+
+Pages that have the marker (FOOTER_MARKER) get the same numbers in place
+of it. books/base.html puts it in its footer for staff only.
+
+Queries slower than INSTRUMENTATION_SLOW_QUERY_MS are logged to the
+"mysite.slow_queries" logger with their SQL, parameters and view name,
+see LOGGING for the rotating file they go to.
+
+When INSTRUMENTATION_ENABLED is off the middleware takes itself out and
+no database wrapper is installed, so the only cost left is one context
+variable lookup per template render.
+"""
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.html import escape
+
+
+logger = logging.getLogger("mysite.slow_queries")
+
+FOOTER_MARKER = b"<!-- request-timing -->"
+
+_current = ContextVar("request_timing", default=None)
+
+
+class Timing:
+    def __init__(self, request):
+        self.request = request
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = False
+
+    @property
+    def view_name(self):
+        match = getattr(self.request, "resolver_match", None)
+        return match.view_name if match is not None else self.request.path
+
+    def summary(self):
+        view = (time.perf_counter() - self.started) * 1000
+        return {"queries": self.queries, "db": self.db * 1000, "template": self.template * 1000, "view": view}
+
+
+def server_timing(summary):
+    return (
+        f'db;dur={summary["db"]:.1f};desc="{summary["queries"]} queries", '
+        f'tpl;dur={summary["template"]:.1f}, view;dur={summary["view"]:.1f}'
+    )
+
+
+# Database
+
+def slow_query_ms():
+    return getattr(settings, "INSTRUMENTATION_SLOW_QUERY_MS", 100)
+
+
+def timed_execute(execute, sql, params, many, context):
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        timing.queries += 1
+        timing.db += duration
+        if duration * 1000 >= slow_query_ms():
+            logger.warning(
+                "%.1f ms in %s on %s: %s; params=%r",
+                duration * 1000, timing.view_name, context["connection"].alias, sql, params,
+                extra={"duration": duration, "sql": sql, "params": params, "view_name": timing.view_name},
+            )
+
+
+_installed = set()
+
+
+def install_execute_wrapper(wrapper):
+    """Puts an execute wrapper on every database connection, now and from now on."""
+    if wrapper in _installed:
+        return
+    _installed.add(wrapper)
+
+    def add(sender=None, connection=None, **kwargs):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+    connection_created.connect(add, weak=False)
+    # Connections are per thread, this only finds the ones open in this one.
+    # Others get it when they reconnect (CONN_MAX_AGE).
+    for connection in connections.all(initialized_only=True):
+        add(connection=connection)
+
+
+# Templates
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timing = _current.get()
+        if timing is None or timing.rendering:
+            # Not timed, or inside a render that already is (widgets, render_to_string)
+            return super().render(context, request)
+        timing.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timing.template += time.perf_counter() - started
+            timing.rendering = False
+
+
+class TimedTemplates(DjangoTemplates):
+    """The Django template backend, with renders timed per request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+# Middleware
+
+class TimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "INSTRUMENTATION_ENABLED", False):
+            raise MiddlewareNotUsed
+        install_execute_wrapper(timed_execute)
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing = Timing(request)
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.add_timings(response, timing)
+
+    async def __acall__(self, request):
+        timing = Timing(request)
+        token = _current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.add_timings(response, timing)
+
+    def add_timings(self, response, timing):
+        summary = timing.summary()
+        response["Server-Timing"] = server_timing(summary)
+        if (
+            not response.streaming
+            and response.get("Content-Type", "").startswith("text/html")
+            and FOOTER_MARKER in response.content
+        ):
+            footer = escape(
+                f'{summary["queries"]} queries in {summary["db"]:.1f} ms, templates {summary["template"]:.1f} ms, '
+                f'view {summary["view"]:.1f} ms ({timing.view_name})'
+            )
+            response.content = response.content.replace(FOOTER_MARKER, footer.encode(), 1)
+            if response.has_header("Content-Length"):
+                response["Content-Length"] = str(len(response.content))
+            etag = response.get("ETag")
+            if etag and not etag.startswith("W/"):
+                # The body differs on every request now
+                response["ETag"] = "W/" + etag
+        return response
@@ -0,0 +1,238 @@
+"""
+N+1 query detection for development and tests.
+
+Every SELECT of a request is reduced to a fingerprint (the SQL with its
+values and IN lists taken out) and counted per place it came from: the
+template line being rendered, or else the innermost line of project
+code. When one fingerprint runs more than NPLUSONE_THRESHOLD times from
+the same place, that is almost always a loop doing one query per row:
+
+    N+1 query: Book.authors, 12 times at books/author_detail.html:19 (author_detail)
+        SELECT ... FROM "books_author" INNER JOIN "books_book_authors" ... WHERE "books_book_authors"."book_id" = ?
+
+The relation is worked out from the tables and the column in the WHERE
+clause, so the fix (select_related/prefetch_related of Book.authors) is
+obvious. It is logged to the "mysite.nplusone" logger, or raised as
+NPlusOneError when NPLUSONE_RAISE is on, which the test runner
+(mysite/testing.py) does for the test suite.
+
+    MIDDLEWARE = [..., "mysite.nplusone.NPlusOneMiddleware", ...]
+    NPLUSONE_ENABLED = DEBUG
+    NPLUSONE_THRESHOLD = 5
+
+Outside requests, wrap the code with detect(). Loops that really are
+meant to repeat a query (processing in chunks) go in allow().
+"""
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from mysite.instrumentation import install_execute_wrapper
+
+
+logger = logging.getLogger("mysite.nplusone")
+
+_current = ContextVar("nplusone_detector", default=None)
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+# Fingerprints
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """The SQL with every value replaced by ? and IN lists of any length made the same."""
+    sql = sql.replace("%s", "?")
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+# Where a query comes from
+
+PROJECT_DIR = os.path.join(str(settings.BASE_DIR), "")
+_SKIPPED = (__file__, os.path.join(os.path.dirname(__file__), "instrumentation.py"))
+
+
+def location():
+    """The template line being rendered, or else the innermost line of project code."""
+    code = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == "render_annotated":
+            # A template node: the innermost one is the line that ran the query
+            node = frame.f_locals.get("self")
+            origin, token = getattr(node, "origin", None), getattr(node, "token", None)
+            if origin is not None and token is not None:
+                return f"{origin.template_name or origin.name}:{token.lineno}"
+        filename = frame.f_code.co_filename
+        if (
+            code is None
+            and filename.startswith(PROJECT_DIR)
+            and "site-packages" not in filename
+            and filename not in _SKIPPED
+        ):
+            code = f"{os.path.relpath(filename, PROJECT_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return code or "unknown"
+
+
+# Which relation
+
+_FROM = re.compile(r'\bFROM\s+"(\w+)"', re.IGNORECASE)
+_WHERE = re.compile(r'\bWHERE\s+\(?"(\w+)"\."(\w+)"\s*(?:=|IN\b)', re.IGNORECASE)
+
+
+def _models_by_table():
+    return {model._meta.db_table: model for model in apps.get_models(include_auto_created=True)}
+
+
+def relation(sql):
+    """
+    Names the relation a per-row query follows ("Book.authors",
+    "Book.publisher", "Publisher.books"), or None.
+    """
+    where = _WHERE.search(sql)
+    if where is None:
+        return None
+    models = _models_by_table()
+    model = models.get(where.group(1))
+    if model is None:
+        return None
+    column = where.group(2)
+
+    if model._meta.auto_created:
+        # Many-to-many through table: which side is the row we loop over?
+        for field in model._meta.get_fields():
+            if getattr(field, "column", None) == column and field.is_relation:
+                for m2m in field.remote_field.model._meta.many_to_many:
+                    if m2m.remote_field.through is model and m2m.m2m_column_name() == column:
+                        return f"{m2m.model.__name__}.{m2m.name}"
+                for m2m in field.remote_field.model._meta.related_objects:
+                    if m2m.many_to_many and m2m.through is model:
+                        return f"{field.remote_field.model.__name__}.{m2m.get_accessor_name()}"
+        return None
+
+    if column == model._meta.pk.column:
+        # Loading the object a foreign key points at, one row at a time
+        target = _FROM.search(sql)
+        if target is None or models.get(target.group(1)) is not model:
+            return None
+        names = [
+            f"{field.model.__name__}.{field.name}"
+            for other in models.values()
+            for field in other._meta.concrete_fields
+            if field.is_relation and field.remote_field.model is model
+            and not other._meta.auto_created
+        ]
+        return " or ".join(sorted(set(names))) or None
+
+    for field in model._meta.concrete_fields:
+        if field.is_relation and field.column == column:
+            # The other end of a foreign key: all rows pointing at one object
+            return f"{field.remote_field.model.__name__}.{field.remote_field.get_accessor_name()}"
+    return None
+
+
+# Detection
+
+class Detector:
+    def __init__(self, name=None, threshold=None, raise_errors=None):
+        self.name = name
+        self.threshold = threshold if threshold is not None else getattr(settings, "NPLUSONE_THRESHOLD", 5)
+        self.raise_errors = raise_errors if raise_errors is not None else getattr(settings, "NPLUSONE_RAISE", False)
+        self.counts = Counter()
+        self.found = []
+        self.paused = 0
+
+    def record(self, sql):
+        if self.paused or not sql.lstrip().upper().startswith("SELECT"):
+            return
+        key = (fingerprint(sql), location())
+        self.counts[key] += 1
+        if self.counts[key] == self.threshold + 1:
+            self.report(sql, *key)
+
+    def report(self, sql, fingerprint, where):
+        name = relation(sql) or "unknown relation"
+        message = f"N+1 query: {name}, {self.threshold + 1} times at {where}"
+        if self.name:
+            message += f" ({self.name})"
+        message += f"\n    {fingerprint}"
+        self.found.append(message)
+        if self.raise_errors:
+            raise NPlusOneError(message)
+        logger.warning(message)
+
+
+def detect_execute(execute, sql, params, many, context):
+    detector = _current.get()
+    if detector is not None:
+        detector.record(sql)
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def detect(name=None, threshold=None, raise_errors=None):
+    """Looks for N+1 queries in the enclosed code. Yields the Detector."""
+    install_execute_wrapper(detect_execute)
+    detector = Detector(name, threshold, raise_errors)
+    token = _current.set(detector)
+    try:
+        yield detector
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def allow():
+    """Doesn't count the queries of the enclosed code, for loops that repeat a query on purpose."""
+    detector = _current.get()
+    if detector is not None:
+        detector.paused += 1
+    try:
+        yield
+    finally:
+        if detector is not None:
+            detector.paused -= 1
+
+
+class NPlusOneMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "NPLUSONE_ENABLED", False):
+            raise MiddlewareNotUsed
+        install_execute_wrapper(detect_execute)
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with detect(request.path):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with detect(request.path):
+            return await self.get_response(request)
+
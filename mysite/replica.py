@@ -0,0 +1,174 @@
+"""
+Read replica: a copy of the SQLite database that the catalog pages read
+from, so they never wait behind an import or a big deletion.
+
+    DATABASES = {
+        "default": {...},
+        "replica": {
+            "ENGINE": "mysite.sqlite",
+            "NAME": BASE_DIR / "replica.sqlite3",
+            "OPTIONS": {"pragmas": {"query_only": 1}},
+            "TEST": {"MIRROR": "default"},
+        },
+    }
+    DATABASE_ROUTERS = ["mysite.replica.ReplicaRouter"]
+    MIDDLEWARE = [..., "django.contrib.sessions.middleware.SessionMiddleware", "mysite.replica.ReplicaMiddleware", ...]
+
+The replica file is a snapshot taken with SQLite's online backup API by
+"manage.py refresh_replica", run from cron or after an import. All writes
+go to default.
+
+Only GET and HEAD requests that pass through ReplicaMiddleware read from
+the replica, and only the catalog tables (REPLICATED). Everything else
+reads from default: sessions, users, jobs, commands, the shell. Reads
+inside a transaction on default, or after the request wrote to a catalog
+table, also stay on default.
+
+A session that wrote to the catalog reads from default until the replica
+has been refreshed after its write, so people see their own changes
+(read-your-writes). Until the replica file exists nothing reads from it.
+"""
+import os
+import sqlite3
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA = "replica"
+
+# Tables that are worth reading from the replica
+REPLICATED = {
+    "books.book",
+    "books.book_authors",
+    "books.author",
+    "books.publisher",
+    "books.classification",
+}
+
+SESSION_KEY = "_replica_wrote_at"
+REFRESHED_KEY = "replica:refreshed_at"
+
+
+class Routing:
+    """Where the reads of the current request go."""
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+_routing = ContextVar("replica_routing", default=None)
+
+
+def replica_path():
+    if REPLICA not in connections.settings:
+        return None
+    return str(connections[REPLICA].settings_dict["NAME"])
+
+
+def replica_available():
+    path = replica_path()
+    return path is not None and os.path.exists(path)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or not routing.use_replica or routing.wrote:
+            return None
+        if model._meta.label_lower not in REPLICATED:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None  # Reading back what the transaction wrote
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None and model._meta.label_lower in REPLICATED:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # Same data in both
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its tables from the backup
+        return db != REPLICA
+
+
+class ReplicaMiddleware:
+    """Decides where each request reads from and remembers sessions that wrote."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _routing.set(self.routing_for(request))
+        try:
+            response = self.get_response(request)
+            self.remember_write(request)
+            return response
+        finally:
+            _routing.reset(token)
+
+    async def __acall__(self, request):
+        # Loading the session is a query
+        token = _routing.set(await sync_to_async(self.routing_for)(request))
+        try:
+            response = await self.get_response(request)
+            self.remember_write(request)
+            return response
+        finally:
+            _routing.reset(token)
+
+    def routing_for(self, request):
+        if request.method not in ("GET", "HEAD") or not replica_available():
+            return Routing(use_replica=False)
+        session = getattr(request, "session", None)
+        wrote_at = session.get(SESSION_KEY) if session is not None else None
+        if wrote_at is not None:
+            if (cache.get(REFRESHED_KEY) or 0) <= wrote_at:
+                return Routing(use_replica=False)
+            del session[SESSION_KEY]  # The replica has caught up
+        return Routing(use_replica=True)
+
+    def remember_write(self, request):
+        routing = _routing.get()
+        if routing.wrote and hasattr(request, "session"):
+            request.session[SESSION_KEY] = time.time()
+
+
+def refresh(pages=-1, progress=None):
+    """
+    Copies default into the replica file with SQLite's online backup API
+    and returns its path. By default in one step: with default in WAL mode
+    that only holds a read snapshot, so writers carry on meanwhile and
+    can't make the copy start over. Readers of the replica wait for it
+    (see busy_timeout).
+    """
+    path = replica_path()
+    if path is None:
+        raise ValueError(f"No {REPLICA!r} database is configured")
+    started = time.time()
+    source = sqlite3.connect(str(connections[DEFAULT_DB_ALIAS].settings_dict["NAME"]))
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+        source.close()
+    # Sessions whose last write was before the copy started (so it is in
+    # the copy) can read from it now
+    cache.set(REFRESHED_KEY, started, None)
+    return path
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,11 +44,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mysite.instrumentation.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'mysite.replica.ReplicaMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'books.reference.ReferenceDataMiddleware',
+    'mysite.nplusone.NPlusOneMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,7 +61,8 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django templates, with render time counted per request
+        'BACKEND': 'mysite.instrumentation.TimedTemplates',
         'DIRS': [BASE_DIR / 'mysite' / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -75,13 +81,37 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# SQLite with WAL and the other pragmas of mysite/sqlite/base.py on every
+# connection. Connections are kept for CONN_MAX_AGE seconds instead of
+# being opened for every request, and checked before they are reused.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'mysite.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Writers queue up for the lock at BEGIN rather than fail half way
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # Snapshot of default that the catalog pages read from, see
+    # mysite/replica.py. Refreshed with "manage.py refresh_replica", not
+    # used until then.
+    'replica': {
+        'ENGINE': 'mysite.sqlite',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pragmas': {'query_only': 1},
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['mysite.replica.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -118,10 +148,124 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+# Default primary key field type (matches the existing migrations)
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = "/books/login/"
 LOGIN_REDIRECT_URL = "/books/"
 LOGOUT_REDIRECT_URL = "/books/login/"
 
 SESSION_COOKIE_AGE = 3600
 SESSION_SAVE_EVERY_REQUEST = True
-SESSION_EXPIRE_AT_BROWSER_CLOSE = False
\ No newline at end of file
+SESSION_EXPIRE_AT_BROWSER_CLOSE = False
+# Number of rows per page for the cursor-paginated book lists
+BOOKS_PAGE_SIZE = 50
+
+# Number of results per page of full-text search
+BOOKS_SEARCH_PAGE_SIZE = 20
+
+# Author/publisher type-ahead: suggestions returned, characters needed
+# before suggesting, and names kept in each per-process prefix index
+BOOKS_AUTOCOMPLETE_LIMIT = 10
+BOOKS_AUTOCOMPLETE_MIN_PREFIX = 2
+BOOKS_AUTOCOMPLETE_MAX_ENTRIES = 500_000
+# Seconds before a process looks for names other processes added or deleted
+BOOKS_AUTOCOMPLETE_TTL = 10
+
+# Options per page fetched by the lazy author/publisher pickers of BookForm
+BOOKS_LOOKUP_PAGE_SIZE = 20
+
+# Publishers are deleted this many books per transaction. When a publisher
+# has more books than that, the deletion is queued as a job for run_worker
+# and the request returns straight away.
+BOOKS_DELETE_CHUNK_SIZE = 500
+BOOKS_BACKGROUND_DELETION = True
+
+# Background jobs (books.jobs, run with "manage.py run_worker"): processes
+# per worker, seconds between looks at the queue when it is empty, and how
+# many jobs of a kind may run at once across all workers
+BOOKS_JOB_WORKERS = 2
+BOOKS_JOB_POLL_INTERVAL = 2
+BOOKS_JOB_CONCURRENCY = {
+    "add_books_from_api": 1,
+    "remove_author": 1,
+    "delete_publisher": 1,
+}
+
+# Every worker keeps a small LRU of cache entries in memory (L1) in front
+# of an on-disk cache shared by all workers (L2), see mysite/cache.py
+CACHES = {
+    'default': {
+        'BACKEND': 'mysite.cache.TwoTierCache',
+        'LOCATION': str(BASE_DIR / '.cache' / 'django'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'L2_BACKEND': 'mysite.cache.LockedFileBasedCache',
+            'MAX_ENTRIES': 10000,
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 60,
+            'GENERATION_CHECK_INTERVAL': 1,
+        },
+    },
+}
+
+# Classifications and publishers are kept in memory by every process
+# (books/reference.py). Outside of requests the copy is checked against
+# the database at most this often, in seconds.
+BOOKS_REFERENCE_TTL = 60
+
+# Cached fragments of the catalog pages (books/fragments.py): seconds a
+# fragment is served before it is rebuilt even if nothing changed, and
+# seconds other requests wait on the one rebuilding it
+BOOKS_FRAGMENT_CACHE_TIMEOUT = 300
+BOOKS_FRAGMENT_CACHE_LOCK_TIMEOUT = 10
+
+# Serve the read-only catalog pages with the async views of
+# books/async_views.py. mysite/asgi.py turns this on, under WSGI the sync
+# views are faster.
+BOOKS_ASYNC_VIEWS = os.environ.get("BOOKS_ASYNC_VIEWS", "0") == "1"
+
+# Query count, database, template and view time of every request, in a
+# Server-Timing header and in the footer for staff (mysite/instrumentation.py).
+# Queries slower than INSTRUMENTATION_SLOW_QUERY_MS go to slow_queries.log.
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_SLOW_QUERY_MS = 100
+
+# Warn when the same query runs more than NPLUSONE_THRESHOLD times from
+# one template line or line of code in a request (mysite/nplusone.py).
+# The test runner turns NPLUSONE_RAISE on, so an N+1 fails its test.
+NPLUSONE_ENABLED = DEBUG
+NPLUSONE_THRESHOLD = 5
+NPLUSONE_RAISE = False
+
+# Runs the tests with their own cache directory and NPLUSONE_RAISE on
+TEST_RUNNER = 'mysite.testing.TestRunner'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'slow_query': {'format': '{asctime} {message}', 'style': '{'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': BASE_DIR / 'slow_queries.log',
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,  # Only create the file once there is something to log
+            'formatter': 'slow_query',
+        },
+    },
+    'loggers': {
+        'mysite.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# On-disk cache of Gutendex API responses used by add_books_from_api
+GUTENDEX_CACHE_DIR = BASE_DIR / '.cache' / 'gutendex'
+GUTENDEX_CACHE_MAX_BYTES = 256 * 1024 * 1024
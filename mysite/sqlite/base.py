@@ -0,0 +1,64 @@
+"""
+SQLite backend with a profile for serving traffic, applied to every new
+connection:
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "mysite.sqlite",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "CONN_MAX_AGE": 600,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "pragmas": {"mmap_size": 512 * 1024 * 1024},  # Merged over PRAGMAS below
+                "transaction_mode": "IMMEDIATE",
+            },
+        },
+    }
+
+WAL lets readers carry on while an import writes, and synchronous=NORMAL
+is safe with WAL (a power cut can lose the last commits, never corrupt
+the file). Unlike the pragmas below, WAL is kept in the database file, so
+it is switched on once by a migration (books 0013) and not on connect:
+merely opening a database, to run a check or a shell, doesn't rewrite it. busy_timeout makes a connection wait for the write lock instead
+of failing straight away with "database is locked".
+
+transaction_mode=IMMEDIATE starts every atomic() block by taking the write
+lock. A deferred transaction that reads first and then writes can't wait
+for the lock when another connection wrote in between, it fails at once
+whatever the busy timeout. Whole transactions that still hit the lock can
+be retried with mysite.sqlite.retry.retry_on_locked().
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+
+PRAGMAS = {
+    "synchronous": "normal",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # Negative is KiB, so 64 MiB per connection
+    "busy_timeout": 5000,  # Milliseconds
+    "temp_store": "memory",
+}
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # Not arguments of sqlite3.connect()
+        self.pragmas = {**PRAGMAS, **params.pop("pragmas", {})}
+        mode = params.pop("transaction_mode", "DEFERRED").upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        self.transaction_mode = mode
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
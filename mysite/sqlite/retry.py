@@ -0,0 +1,34 @@
+import random
+import time
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+
+ATTEMPTS = 5
+BACKOFF = 0.05  # Seconds before the first retry, doubled after each one
+
+
+def is_locked(exc):
+    return isinstance(exc, OperationalError) and "locked" in str(exc)
+
+
+def retry_on_locked(func, attempts=ATTEMPTS, backoff=BACKOFF, using=DEFAULT_DB_ALIAS):
+    """
+    Calls func(), which should run one whole transaction, again when it
+    fails with "database is locked", up to `attempts` times in all.
+
+    Inside an outer atomic() block there is nothing safe to retry, the
+    outer transaction is already broken, so func() is only called once.
+    func() must be fine to call again after a rollback: don't let it
+    change state outside the database before the transaction commits.
+    """
+    if connections[using].in_atomic_block:
+        return func()
+    for attempt in range(attempts):
+        try:
+            return func()
+        except OperationalError as exc:
+            if not is_locked(exc) or attempt == attempts - 1:
+                raise
+        # Jitter so writers that collided don't collide again
+        time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
@@ -0,0 +1,45 @@
+"""
+The test runner of the project (TEST_RUNNER).
+
+    TEST_RUNNER = "mysite.testing.TestRunner"
+
+On top of Django's runner it
+
+- points every cache at a temporary directory, so tests that clear the
+  cache don't wipe the one the development server uses,
+- puts the test database in a file in that directory rather than in
+  memory, so tests can read from other threads while a transaction is
+  open (SQLite's shared in-memory databases lock whole tables instead),
+  and
+- turns NPLUSONE_RAISE on, so a test that runs an N+1 query fails (see
+  mysite/nplusone.py).
+"""
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_directory = tempfile.mkdtemp(prefix="mysite-test-")
+        self.caches = override_settings(CACHES={
+            alias: dict(config, LOCATION=os.path.join(self.cache_directory, alias))
+            for alias, config in settings.CACHES.items()
+        })
+        self.caches.enable()
+        connections[DEFAULT_DB_ALIAS].settings_dict["TEST"]["NAME"] = os.path.join(
+            self.cache_directory, "test.sqlite3"
+        )
+        settings.NPLUSONE_ENABLED = True
+        settings.NPLUSONE_RAISE = True
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches.disable()
+        shutil.rmtree(self.cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)